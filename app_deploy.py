@@ -30,20 +30,31 @@ def add_user_message(message, history, user_id):
     return gr.update(value=""), history, user_id
 
 
-def predict(history, last_question_id, user_id):
+async def predict(history, last_question_id, user_id, corpora=None, request: gr.Request = None):
+    # 异步生成器：等待 LLM 流式输出时不占用 Gradio 的工作线程
+    # 每帧只包含合并后的增量文本，Gradio 向浏览器发送的也只是与上一帧的差异
     user_message = history[-1][0]
-    response_generator = chatbot_instance.stream_chat(user_message, history[:-1], user_id)
+    response_generator = chatbot_instance.astream_chat_deltas(user_message, history[:-1], user_id, corpora)
 
     q_id = None
-    for item in response_generator:
-        if not isinstance(item, tuple) or len(item) != 2:
-            print(f"错误：生成器返回了无效格式的数据: {item}")  # 调试信息
-            continue
-        answer_chunk, q_id_chunk = item
-        history[-1][1] = answer_chunk
-        if q_id_chunk:
-            q_id = q_id_chunk
-        yield history, q_id
+    history[-1][1] = ""
+    try:
+        async for item in response_generator:
+            if not isinstance(item, tuple) or len(item) != 2:
+                print(f"错误：生成器返回了无效格式的数据: {item}")  # 调试信息
+                continue
+            answer_delta, q_id_chunk = item
+            history[-1][1] += answer_delta
+            if q_id_chunk:
+                q_id = q_id_chunk
+            # 用户关闭页面后不再继续生成
+            if request is not None and request.request is not None and await request.request.is_disconnected():
+                print("客户端已断开，停止生成。")
+                break
+            yield history, q_id
+    finally:
+        # 点击“清空对话”（事件被取消）或客户端断开时，立即关闭上游的 LLM 流并记录为已取消
+        await response_generator.aclose()
 
 
 def handle_feedback(feedback_choice, last_id):
@@ -777,6 +788,13 @@ with gr.Blocks(theme=gr.themes.Soft(), css=custom_css, title="SwanLab AI文档
                 incorrect_btn = gr.Button("👎 回答无帮助", variant="secondary", elem_classes="feedback-btn")
                 feedback_btn = gr.Button("📝 反馈建议", variant="secondary", elem_classes="feedback-btn")
                 clear_btn = gr.Button("🗑️ 清空对话", variant="secondary", elem_classes="feedback-btn")
+            # 检索范围：只有加载了多个语料分片时才显示，不选择时按问题自动路由
+            corpus_selector = gr.CheckboxGroup(
+                choices=[shard.name for shard in chatbot_instance.shards],
+                value=[],
+                label="检索范围（不选则根据问题自动选择）",
+                visible=len(chatbot_instance.shards) > 1
+            )
 
 
     # 示例问题区域
@@ -948,26 +966,30 @@ with gr.Blocks(theme=gr.themes.Soft(), css=custom_css, title="SwanLab AI文档
     gr.HTML(collapse_js)
 
     # 修改事件绑定，添加用户ID参数
-    msg_textbox.submit(
+    submit_event = msg_textbox.submit(
         fn=add_user_message,
         inputs=[msg_textbox, chatbot, user_id],
         outputs=[msg_textbox, chatbot, user_id],
         queue=False
     ).then(
         fn=predict,
-        inputs=[chatbot, last_question_id, user_id],
-        outputs=[chatbot, last_question_id]
+        inputs=[chatbot, last_question_id, user_id, corpus_selector],
+        outputs=[chatbot, last_question_id],
+        # predict 是异步生成器，并发的流式回答共享同一个事件循环，不需要按线程数限流
+        concurrency_limit=None
     )
 
-    submit_btn.click(
+    click_event = submit_btn.click(
         fn=add_user_message,
         inputs=[msg_textbox, chatbot, user_id],
         outputs=[msg_textbox, chatbot, user_id],
         queue=False
     ).then(
         fn=predict,
-        inputs=[chatbot, last_question_id, user_id],
-        outputs=[chatbot, last_question_id]
+        inputs=[chatbot, last_question_id, user_id, corpus_selector],
+        outputs=[chatbot, last_question_id],
+        # predict 是异步生成器，并发的流式回答共享同一个事件循环，不需要按线程数限流
+        concurrency_limit=None
     )
 
     correct_btn.click(
@@ -994,7 +1016,9 @@ with gr.Blocks(theme=gr.themes.Soft(), css=custom_css, title="SwanLab AI文档
 
     clear_btn.click(
         fn=lambda: [None, []],
-        outputs=[last_question_id, chatbot]
+        outputs=[last_question_id, chatbot],
+        # 清空对话时取消正在生成的回答
+        cancels=[submit_event, click_event]
     )
 
 # 添加Flask路由处理用户管理
@@ -1030,10 +1054,14 @@ def update_user_exit():
 
 # 启动应用
 if __name__ == "__main__":
-    demo.launch(
-        server_name="0.0.0.0",
-        server_port=7860, #选择端口
-        share=True,
-        ssl_keyfile="私钥路径",  #私钥路径
-        ssl_certfile="公钥路径"  #公钥路径
-    )
\ No newline at end of file
+    try:
+        demo.launch(
+            server_name="0.0.0.0",
+            server_port=7860, #选择端口
+            share=True,
+            ssl_keyfile="私钥路径",  #私钥路径
+            ssl_certfile="公钥路径"  #公钥路径
+        )
+    finally:
+        # 服务退出时关闭上游连接池（包括各事件循环上的 aiohttp 会话）与后台线程
+        chatbot_instance.close()
\ No newline at end of file
@@ -0,0 +1,144 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+##微批处理：把并发的单个请求合并为一次批量调用
+# 没有批次在执行时，请求（连同已在排队的请求）立即发送，空闲时不增加延迟；
+# 已有批次在执行时，第一个请求到达后最多再等待 max_wait 秒（或凑满 max_batch_size 个）收集同时到达的请求。
+# 合并后调用一次 batch_fn，再把结果逐个交还给各自的调用方；
+# 高峰时一次调用处理多个请求，减少上游请求数或 FAISS search 的调用次数。
+
+
+class MicroBatcher:
+    """
+    线程安全的微批处理器。batch_fn 接收请求列表，返回等长的结果列表（顺序与请求一致）。
+    submit() 返回 concurrent.futures.Future，异步代码可以用 asyncio.wrap_future 等待；
+    最多同时执行 max_concurrency 次 batch_fn，全部在执行时新到达的请求继续排队，有空闲时合并为下一批。
+    max_concurrency 为 1 时批次直接在收集线程中执行，少一次线程切换。
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 32, max_wait: float = 0.005, max_concurrency: int = 4,
+                 name: str = "batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._executor = None
+        if max_concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=name)
+        self._slots = threading.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._running = 0
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.errors = 0
+        self.wait_seconds = 0.0   # 请求从提交到所在批次开始执行的累计等待时间
+        self.call_seconds = 0.0   # batch_fn 的累计执行时间
+        self._collector = threading.Thread(target=self._collect, name=f"{name}-collector", daemon=True)
+        self._collector.start()
+
+    def submit(self, item) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} 已关闭")
+            self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item):
+        """提交单个请求并阻塞等待其结果。"""
+        return self.submit(item).result()
+
+    def _collect(self) -> None:
+        while True:
+            self._slots.acquire()
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            with self._lock:
+                busy = self._running > 0
+                self._running += 1
+            # 没有批次在执行时不等待，只带上已经在排队的请求
+            deadline = time.perf_counter() + (self.max_wait if busy else 0.0)
+            stop = False
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        entry = self._queue.get(timeout=remaining)
+                    else:
+                        entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            if self._executor is None:
+                self._run_batch(batch)
+            else:
+                self._executor.submit(self._run_batch, batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch) -> None:
+        # 调用方已取消的请求不再发送
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            with self._lock:
+                self._running -= 1
+            self._slots.release()
+            return
+        start = time.perf_counter()
+        try:
+            results = self.batch_fn([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name}: {len(batch)} 个请求返回了 {len(results)} 个结果")
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_seen = max(self.max_seen, len(batch))
+                self.wait_seconds += sum(start - submitted for _, _, submitted in batch)
+                self.call_seconds += end - start
+                self._running -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """批次数、请求数、平均/最大批大小、平均排队等待与单次调用耗时（ms）、失败批次数以及排队中的请求数。"""
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_seen,
+                "avg_wait_ms": self.wait_seconds / self.items * 1000 if self.items else 0.0,
+                "avg_call_ms": self.call_seconds / self.batches * 1000 if self.batches else 0.0,
+                "errors": self.errors,
+                "pending": self._queue.qsize(),
+            }
+
+    def close(self) -> None:
+        """不再接受新的请求；已提交的请求仍会执行完毕。"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._collector.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,95 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import faiss
+
+from vector_index import (INDEX_TYPES, REDUCE_METHODS, BinaryRescoreIndex, VectorTransform, add_vectors,
+                          apply_search_params, create_index, index_nbytes, index_params, train_index)
+
+##对比不同索引类型的召回率、查询延迟与内存占用
+# 从已构建索引目录中的 vectors.npy 读取向量，随机留出一部分作为查询，
+# 以 flat 索引的精确结果为基准计算 recall@k，并逐条查询统计 p50/p99 延迟。
+# 内存为索引序列化后的大小；binary_rescore 只统计常驻的二值编码，精排用的原始向量通过 memmap 按需读取。
+# 指定 --dims 时还会对每个降维维度重复测试，召回率始终以全维度 flat 索引的结果为基准。
+
+
+def split_queries(vectors: np.ndarray, num_queries: int, seed: int = 0):
+    """随机留出 num_queries 条向量作为查询，其余作为库向量。"""
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(vectors))
+    query_rows = np.sort(order[:num_queries])
+    base_rows = np.sort(order[num_queries:])
+    return np.ascontiguousarray(vectors[base_rows]), np.ascontiguousarray(vectors[query_rows])
+
+
+def recall_at_k(result_ids: np.ndarray, truth_ids: np.ndarray) -> float:
+    """计算 recall@k：每条查询的结果与精确结果的交集占比，取平均。"""
+    hits = [len(set(result) & set(truth)) / len(truth) for result, truth in zip(result_ids, truth_ids)]
+    return float(np.mean(hits))
+
+
+def measure_latency(index: faiss.Index, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """逐条查询（与 stream_chat 的用法一致），返回结果 id 和每次查询的耗时（毫秒）。"""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids[i:i + 1] = index.search(queries[i:i + 1], k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return ids, latencies
+
+
+def build(params: dict, base: np.ndarray, transform: VectorTransform) -> tuple[faiss.Index, float]:
+    start = time.perf_counter()
+    transform.train(base)
+    index = create_index(params, transform.output_dim, len(base))
+    train_index(index, base, transform)
+    add_vectors(index, base, transform)
+    if isinstance(index, faiss.IndexBinary):
+        index = BinaryRescoreIndex(index, base, params["rescore_k"], transform)
+    else:
+        apply_search_params(index, params)
+    return index, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比不同 FAISS 索引类型的 recall@k 与查询延迟")
+    parser.add_argument("--index-path", default="faiss_index_scratch_all", help="包含 vectors.npy 的索引目录")
+    parser.add_argument("--types", default=",".join(INDEX_TYPES), help="要对比的索引类型，逗号分隔")
+    parser.add_argument("--queries", type=int, default=200, help="留出作为查询的向量数")
+    parser.add_argument("-k", type=int, default=10, help="召回的结果数")
+    parser.add_argument("--reduce-method", choices=REDUCE_METHODS[1:], default="truncate", help="降维方式")
+    parser.add_argument("--dims", default="", help="额外测试的降维维度，逗号分隔，如 256,512")
+    args = parser.parse_args()
+
+    vectors = np.load(os.path.join(args.index_path, "vectors.npy"), mmap_mode='r')
+    base, queries = split_queries(vectors, min(args.queries, len(vectors) // 10 or 1))
+    print(f"库向量 {len(base)} 条，查询 {len(queries)} 条，维度 {base.shape[1]}，k={args.k}")
+
+    dimension = base.shape[1]
+    flat, _ = build(index_params("flat"), base, VectorTransform("none", dimension))
+    _, truth_ids = flat.search(queries, args.k)
+    flat_bytes = index_nbytes(flat)
+
+    print(f"{'维度':<14}{'索引类型':<16}{'参数':<48}{'构建(s)':>9}{'recall@' + str(args.k):>11}"
+          f"{'p50(ms)':>10}{'p99(ms)':>10}{'内存(MB)':>10}{'压缩比':>8}")
+    dims = [None] + [int(dim) for dim in args.dims.split(",") if dim]
+    for dim in dims:
+        method = "none" if dim is None else args.reduce_method
+        label = str(dimension) if dim is None else f"{dim}/{method}"
+        for index_type in args.types.split(","):
+            params = index_params(index_type, reduce_method=method, reduce_dim=dim)
+            transform = VectorTransform.from_params(params, dimension)
+            index, build_time = build(params, base, transform)
+            ids, latencies = measure_latency(index, transform.apply(queries), args.k)
+            nbytes = index_nbytes(index)
+            shown = {key: value for key, value in params.items() if key not in ("index_type", "reduce_method", "reduce_dim")}
+            print(f"{label:<14}{index_type:<16}{str(shown):<48}{build_time:>9.2f}{recall_at_k(ids, truth_ids):>11.3f}"
+                  f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+                  f"{nbytes / 2 ** 20:>10.2f}{flat_bytes / nbytes:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batching import MicroBatcher
+from benchmark_index import build, split_queries
+from vector_index import VectorTransform, index_params, set_search_threads
+
+##对比并发检索时逐条搜索与批处理搜索的吞吐量
+# 模拟 --clients 个并发请求线程（相当于 Gradio 的工作线程），每个线程逐条提交查询：
+#   direct   每个线程各自调用 index.search（原 stream_chat 的做法，多个线程的 OpenMP 线程池互相争抢核心）
+#   batched  查询提交到 MicroBatcher，同一时刻只执行一次 index.search，执行期间到达的查询合并为下一批
+#            （与 CorpusShard.enable_batching 相同，空闲时的查询立即执行）
+# 对每种索引类型和每个 OpenMP 线程数分别测试，输出每秒查询数（qps）与单次查询的 p50/p99 延迟。
+# 库向量不足时可以用 --base-size 在原向量附近生成更多的库向量，使搜索耗时接近实际规模。
+
+
+def expand_base(base: np.ndarray, size: int, seed: int = 0) -> np.ndarray:
+    """在已有向量上叠加小的随机扰动，生成 size 条库向量。"""
+    if size <= len(base):
+        return base
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(base), size)
+    noise = rng.standard_normal((size, base.shape[1])).astype(np.float32) * 0.05
+    vectors = base[rows] + noise
+    return np.ascontiguousarray(vectors / np.linalg.norm(vectors, axis=1, keepdims=True), dtype=np.float32)
+
+
+def run_clients(search_one, queries: np.ndarray, clients: int) -> tuple[float, np.ndarray]:
+    """clients 个线程并发地逐条查询全部 queries，返回 (qps, 每次查询的耗时 ms)。"""
+    latencies = np.empty(len(queries))
+
+    def client(offset):
+        for i in range(offset, len(queries), clients):
+            start = time.perf_counter()
+            search_one(queries[i])
+            latencies[i] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    return len(queries) / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比并发检索时逐条搜索与批处理搜索的 qps")
+    parser.add_argument("--index-path", default="faiss_index_scratch_all", help="包含 vectors.npy 的索引目录")
+    parser.add_argument("--types", default="flat,hnsw,ivf_flat", help="要对比的索引类型，逗号分隔")
+    parser.add_argument("--threads", default="", help="OpenMP 线程数，逗号分隔，默认为 1,2,4... 直到 CPU 核数")
+    parser.add_argument("--clients", type=int, default=16, help="并发的请求线程数")
+    parser.add_argument("--queries", type=int, default=2000, help="每组测试的查询数")
+    parser.add_argument("--base-size", type=int, default=0, help="库向量数，大于实际向量数时在其附近生成")
+    parser.add_argument("-k", type=int, default=10, help="召回的结果数")
+    parser.add_argument("--batch-size", type=int, default=64, help="批处理的最大批大小")
+    args = parser.parse_args()
+
+    vectors = np.load(os.path.join(args.index_path, "vectors.npy"), mmap_mode='r')
+    base, held_out = split_queries(vectors, min(200, len(vectors) // 10 or 1))
+    base = expand_base(base, args.base_size)
+    queries = held_out[np.random.default_rng(1).integers(0, len(held_out), args.queries)]
+    cores = os.cpu_count() or 1
+    if args.threads:
+        thread_counts = [int(count) for count in args.threads.split(",") if count]
+    else:
+        thread_counts = sorted({min(2 ** i, cores) for i in range(cores.bit_length() + 1)})
+    print(f"库向量 {len(base)} 条，查询 {len(queries)} 条，维度 {base.shape[1]}，k={args.k}，"
+          f"{args.clients} 个并发请求线程，CPU 核数 {cores}")
+    print(f"{'索引类型':<12}{'线程数':>6}{'方式':>10}{'qps':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'平均批大小':>10}")
+
+    dimension = base.shape[1]
+    for index_type in args.types.split(","):
+        params = index_params(index_type)
+        index, _ = build(params, base, VectorTransform.from_params(params, dimension))
+        for num_threads in thread_counts:
+            num_threads = set_search_threads(num_threads)
+
+            def direct(query):
+                return index.search(query.reshape(1, -1), args.k)
+
+            qps, latencies = run_clients(direct, queries, args.clients)
+            print(f"{index_type:<12}{num_threads:>8}{'direct':>12}{qps:>12.0f}"
+                  f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}{1:>14.1f}")
+
+            batcher = MicroBatcher(lambda batch: list(zip(*index.search(np.stack(batch), args.k))),
+                                   args.batch_size, max_wait=0.0, max_concurrency=1, name="benchmark-search")
+            qps, latencies = run_clients(batcher, queries, args.clients)
+            batcher.close()
+            print(f"{index_type:<12}{num_threads:>8}{'batched':>12}{qps:>12.0f}"
+                  f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+                  f"{batcher.stats()['avg_batch_size']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
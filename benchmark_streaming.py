@@ -0,0 +1,74 @@
+import json
+import time
+import asyncio
+import argparse
+
+from streaming import STREAM_FRAME_INTERVAL, coalesce_deltas
+
+##对比流式输出方式的 CPU 开销与传输字节数
+# 模拟 LLM 以固定间隔逐个产出 token，分别以三种方式推送到界面：
+#   full      每个 token 发送完整的对话历史（原 stream_chat + predict 的做法）
+#   delta     每个 token 只发送新增文本
+#   coalesced 按时间窗口合帧后只发送新增文本（astream_chat_deltas 的做法）
+# 每一帧服务端都要序列化一次完整的对话历史（相当于 Gradio 对输出的后处理与比较），
+# 传输字节数在 full 方式下为完整历史，增量方式下为增量文本；CPU 时间为整个回答期间的进程 CPU 时间。
+
+
+async def token_source(tokens: list[str], interval: float):
+    for token in tokens:
+        yield token, None
+        await asyncio.sleep(interval)
+
+
+async def run_full(tokens, interval, history):
+    frames = nbytes = 0
+    answer = ""
+    async for token, _ in token_source(tokens, interval):
+        answer += token
+        history[-1][1] = answer
+        state = json.dumps(history, ensure_ascii=False)
+        nbytes += len(state.encode('utf-8'))
+        frames += 1
+    return frames, nbytes
+
+
+async def run_delta(tokens, interval, history, frame_interval=None):
+    frames = nbytes = 0
+    deltas = token_source(tokens, interval)
+    if frame_interval is not None:
+        deltas = coalesce_deltas(deltas, frame_interval)
+    async for delta, _ in deltas:
+        history[-1][1] += delta
+        json.dumps(history, ensure_ascii=False)
+        nbytes += len(json.dumps(delta, ensure_ascii=False).encode('utf-8'))
+        frames += 1
+    return frames, nbytes
+
+
+def measure(mode, coroutine):
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    frames, nbytes = asyncio.run(coroutine)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    print(f"{mode:<12}{frames:>8}{nbytes / 1024:>14.1f}{cpu * 1000:>12.1f}{wall:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比逐 token 发送完整答案与合帧增量发送的开销")
+    parser.add_argument("--tokens", type=int, default=600, help="模拟回答的 token 数")
+    parser.add_argument("--token-interval", type=float, default=0.005, help="上游 token 的产出间隔（秒）")
+    parser.add_argument("--frame-interval", type=float, default=STREAM_FRAME_INTERVAL, help="合帧的时间窗口（秒）")
+    parser.add_argument("--history-turns", type=int, default=3, help="界面中已有的历史问答轮数")
+    args = parser.parse_args()
+
+    tokens = [f"第{i}段回答内容" if i % 2 else f" token{i}" for i in range(args.tokens)]
+    prior = [["历史问题", "历史回答" * 200] for _ in range(args.history_turns)]
+    print(f"{args.tokens} 个 token，间隔 {args.token_interval * 1000:.0f} ms，合帧窗口 {args.frame_interval * 1000:.0f} ms，"
+          f"历史 {args.history_turns} 轮")
+    print(f"{'方式':<10}{'帧数':>8}{'传输(KB)':>12}{'CPU(ms)':>11}{'耗时(s)':>9}")
+    measure("full", run_full(tokens, args.token_interval, prior + [["问题", None]]))
+    measure("delta", run_delta(tokens, args.token_interval, prior + [["问题", ""]]))
+    measure("coalesced", run_delta(tokens, args.token_interval, prior + [["问题", ""]], args.frame_interval))
+
+
+if __name__ == "__main__":
+    main()
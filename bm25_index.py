@@ -0,0 +1,146 @@
+import io
+import os
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+
+from chunk_store import ChunkStore
+
+##BM25 倒排索引：替代逐个 chunk 的 str.count 扫描，查询只访问命中词项的倒排表
+# 分词：英文/数字按单词切分；中文没有空格，按连续汉字的单字和相邻二字（bigram）切分，
+# 这样 "如何记录实验" 可以命中包含 "记录" 或 "实验" 的 chunk，而不是被当作一整个关键词。
+# 倒排表以 CSR 形式保存，每个 posting 直接存预先算好的 BM25 权重，查询时只需累加。
+BM25_FILE = "bm25.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """把文本切分为检索词项：英文单词，以及中文的单字和二字组合。"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        else:
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    只读的 BM25 倒排索引。
+    vocab（按字典序排列的词项）与 term_offsets 描述每个词项在 doc_ids / weights 中的区间，
+    weights 为该词项对该 chunk 的 BM25 得分。
+    """
+
+    def __init__(self, vocab: list[str], term_offsets: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray):
+        self.vocab = vocab
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self._term_ids = {term: i for i, term in enumerate(vocab)}
+
+    @classmethod
+    def build(cls, chunks, k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """从可迭代的 chunk 文本构建索引，chunk id 即迭代顺序。"""
+        postings = {}
+        doc_lengths = []
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(tf)
+
+        doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        num_docs = len(doc_lengths)
+        avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+        # 长度归一化项 k1 * (1 - b + b * dl / avgdl)，每个 chunk 只算一次
+        norms = k1 * (1 - b + b * doc_lengths / avg_length) if avg_length else np.full(num_docs, k1, dtype=np.float32)
+
+        vocab = sorted(postings)
+        term_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(postings[term][0]) for term in vocab])
+        doc_ids = np.empty(term_offsets[-1], dtype=np.int32)
+        weights = np.empty(term_offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            ids = np.asarray(postings[term][0], dtype=np.int32)
+            tf = np.asarray(postings[term][1], dtype=np.float32)
+            idf = np.log(1 + (num_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            doc_ids[term_offsets[i]:term_offsets[i + 1]] = ids
+            weights[term_offsets[i]:term_offsets[i + 1]] = idf * tf * (k1 + 1) / (tf + norms[ids])
+        return cls(vocab, term_offsets, doc_ids, weights)
+
+    def search(self, query: str, k: int = 10) -> list[tuple[float, int]]:
+        """返回按 BM25 得分降序的 (得分, chunk id) 列表，只访问查询词项的倒排表。"""
+        rows = []
+        for term, count in Counter(tokenize(query)).items():
+            term_id = self._term_ids.get(term)
+            if term_id is not None:
+                rows.append((term_id, count))
+        if not rows:
+            return []
+
+        ids = np.concatenate([self.doc_ids[self.term_offsets[t]:self.term_offsets[t + 1]] for t, _ in rows])
+        weights = np.concatenate([self.weights[self.term_offsets[t]:self.term_offsets[t + 1]] * count
+                                  for t, count in rows])
+        docs, inverse = np.unique(ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(float(scores[i]), int(docs[i])) for i in top]
+
+    def serialize(self) -> bytes:
+        buffer = io.BytesIO()
+        # 词项保存为 UTF-8 拼接的字节串与偏移表（与 chunk 存储相同），定长字符串数组会按最长的词项为每个词项分配空间
+        encoded = [term.encode('utf-8') for term in self.vocab]
+        vocab_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        vocab_offsets[1:] = np.cumsum([len(term) for term in encoded])
+        vocab_blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        np.savez(buffer, vocab_blob=vocab_blob, vocab_offsets=vocab_offsets, term_offsets=self.term_offsets, doc_ids=self.doc_ids, weights=self.weights)
+        return buffer.getvalue()
+
+    @classmethod
+    def deserialize(cls, data) -> "BM25Index":
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            if "vocab_blob" in arrays:
+                blob = arrays["vocab_blob"].tobytes()
+                offsets = arrays["vocab_offsets"].tolist()
+                vocab = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+            else:
+                # 旧版本以定长字符串数组保存的词项
+                vocab = arrays["vocab"].tolist()
+            return cls(vocab, arrays["term_offsets"], arrays["doc_ids"], arrays["weights"])
+
+    def save(self, index_path: str) -> None:
+        with open(os.path.join(index_path, BM25_FILE), 'wb') as f:
+            f.write(self.serialize())
+
+    @classmethod
+    def load(cls, index_path: str) -> "BM25Index":
+        with open(os.path.join(index_path, BM25_FILE), 'rb') as f:
+            return cls.deserialize(f.read())
+
+    @staticmethod
+    def exists(index_path: str) -> bool:
+        return os.path.exists(os.path.join(index_path, BM25_FILE))
+
+
+if __name__ == "__main__":
+    # 为已有的索引目录补建 BM25 索引
+    if len(sys.argv) != 2:
+        print("用法: python bm25_index.py <索引目录>")
+        sys.exit(1)
+    store = ChunkStore.open(sys.argv[1])
+    bm25 = BM25Index.build(store)
+    bm25.save(sys.argv[1])
+    print(f"BM25 索引构建完成：{len(store)} 个 chunks，{len(bm25.vocab)} 个词项，{len(bm25.doc_ids)} 个 postings。")
@@ -1,19 +1,60 @@
 import os
 import json
+import time
 import sqlite3
+import asyncio
+import weakref
 from datetime import datetime
 import requests
+import aiohttp
 import numpy as np
-import faiss
 from collections import Counter
-import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from batching import MicroBatcher
+from bm25_index import BM25Index
+from caches import LRUCache
+from chunk_store import ChunkStore, convert_json
+from context_packer import pack_context
+from corpus_shard import SHARDS_CONFIG_PATH, URL_MAP_FILE, CorpusShard, directory_version, load_shards_config
+from http_client import PooledSession
+from index_bundle import IndexBundle
+from retrieval import fuse_hits
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+from streaming import STREAM_FRAME_INTERVAL, coalesce_deltas
+from text_utils import estimate_tokens, normalize_query
+from vector_index import load_index, set_search_threads
+
+# Prompt 模板（不带缩进，缩进空白也会计入 token）
+PROMPT_TEMPLATE = """# 角色
+你是一个 SwanLab 开源项目的文档问答助手
+#指令
+1，根据提供的 [背景知识] 回答 [问题]。如果未找到任何相关的，则提醒用户未找到参考资料，根据你现有的知识给予意见。
+2.回答时，叙述风格可以使用一些图标，使其更人性化。
+3.回答完成后，可以反问用户一些相关的问题。
+4.如果遇到一些网页地址存在不够完整，请在地址前面添加"https://docs.swanlab.cn/",并且把".md"替换为".html"。
+---
+[背景知识]
+{context}
+---
+# 本次提问
+[问题]
+{question}
+---
+你的回答:
+"""
+# 旧模板每行 16 个空格的缩进，用于统计节省的 token
+TEMPLATE_INDENT_TOKENS = estimate_tokens(" " * 16 * (PROMPT_TEMPLATE.count("\n") + 1))
 
 
 class Chatbot:
     def __init__(self,
                  index_path="faiss_index_scratch_all",
                  url_map_path="swanlab_docs_Internet8-2.json",
-                 db_path="/data/user_questions.db"):
+                 db_path="/data/user_questions.db",
+                 shards_config=SHARDS_CONFIG_PATH):
         print("正在初始化 Chatbot...")
         self.FAISS_INDEX_PATH = index_path
         self.URL_MAP_PATH = url_map_path
@@ -23,10 +64,68 @@ class Chatbot:
         self.EMBEDDING_MODEL = "填写Embedding模型"
         self.LLM_MODEL = "填写LLM模型"
         self.VECTOR_DIMENSION = 1024
+        # 查询向量缓存：重复的问题（包括示例问题）不再请求 embedding 接口
+        self.QUERY_CACHE_SIZE = 4096
+        self.QUERY_CACHE_TTL = 24 * 3600
+        self.QUERY_CACHE_MAX_BYTES = 64 * 2 ** 20
+        # 答案缓存：无历史对话的相同问题直接回放已生成的答案，键中包含索引版本，重建索引后自动失效
+        self.ANSWER_CACHE_SIZE = 1024
+        self.ANSWER_CACHE_TTL = 7 * 24 * 3600
+        self.ANSWER_CACHE_MAX_BYTES = 32 * 2 ** 20
+        # 语义缓存：与历史问题的余弦相似度不低于阈值时复用其答案，被反馈为错误的答案不会再被复用
+        self.SEMANTIC_CACHE_THRESHOLD = 0.92
+        self.SEMANTIC_CACHE_TTL = 7 * 24 * 3600
+        self.SEMANTIC_CACHE_SIZE = 10000
+        # 上游 HTTP 连接池：embedding 与 LLM 各用一个，长时间的流式回答不会占满 embedding 请求的连接
+        self.HTTP_POOL_SIZE = 32
+        self.EMBEDDING_TIMEOUT = (3.05, 10)
+        self.CHAT_TIMEOUT = (3.05, 100)
+        # astream_chat 每条流式回答只占一个连接而不占线程，LLM 连接池可以大得多
+        self.ASYNC_CHAT_POOL_SIZE = 512
+        # 查询 embedding 微批处理：并发的问题最多等待 EMBEDDING_BATCH_MAX_WAIT 秒，合并为一次 /embeddings 请求
+        self.EMBEDDING_BATCH_SIZE = 32
+        self.EMBEDDING_BATCH_MAX_WAIT = 0.005
+        self.EMBEDDING_BATCH_CONCURRENCY = 4
+        # 每个分片的向量检索与关键词检索各取的结果数
+        self.RETRIEVAL_K = 10
+        # 背景知识的 token 预算
+        self.CONTEXT_TOKEN_BUDGET = 3000
+        # 向量检索批处理：每个分片同一时刻只执行一次 index.search，执行期间到达的查询向量合并为下一批。
+        # 只对向量数不少于 SEARCH_BATCH_MIN_VECTORS 的分片启用（None 时全部关闭）：
+        # 小索引单次搜索只需几十微秒，线程切换的开销反而使吞吐量下降、延迟上升（见 benchmark_search.py）
+        self.SEARCH_BATCH_SIZE = 64
+        self.SEARCH_BATCH_MIN_VECTORS = 20000
+        # FAISS 的 OpenMP 线程数（整个进程生效）；None 时按 CPU 核数平分给各分片，多个分片同时搜索也不会超过核数
+        self.FAISS_OMP_THREADS = None
 
         self.db = self._init_database(db_path)
-        self.url_map = self._load_url_map(self.URL_MAP_PATH)
-        self.index, self.index_to_chunk = self._load_vector_store(self.FAISS_INDEX_PATH)
+        self.embedding_http = PooledSession(pool_maxsize=self.HTTP_POOL_SIZE, timeout=self.EMBEDDING_TIMEOUT)
+        self.chat_http = PooledSession(pool_maxsize=self.HTTP_POOL_SIZE, timeout=self.CHAT_TIMEOUT)
+        # 同步与异步的问答共用一个批处理器，异步代码通过 asyncio.wrap_future 等待结果
+        self.embedding_batcher = MicroBatcher(self._request_query_embeddings, self.EMBEDDING_BATCH_SIZE,
+                                              self.EMBEDDING_BATCH_MAX_WAIT, self.EMBEDDING_BATCH_CONCURRENCY,
+                                              name="embedding-batch")
+        # 异步问答的 LLM 会话（aiohttp）绑定创建时的事件循环，按循环分别创建：事件循环 -> ClientSession
+        self._aiohttp_sessions = weakref.WeakKeyDictionary()
+        self.query_embedding_cache = LRUCache(self.QUERY_CACHE_SIZE, self.QUERY_CACHE_TTL, self.QUERY_CACHE_MAX_BYTES)
+        self.answer_cache = LRUCache(self.ANSWER_CACHE_SIZE, self.ANSWER_CACHE_TTL, self.ANSWER_CACHE_MAX_BYTES)
+        self.shards = self._load_shards(shards_config)
+        self._configure_search()
+        self.semantic_cache = SemanticCache(self.VECTOR_DIMENSION, self.SEMANTIC_CACHE_THRESHOLD,
+                                            self.SEMANTIC_CACHE_TTL, self.SEMANTIC_CACHE_SIZE)
+        # 回放缓存答案时新保存的问题 id -> 原答案的问题 id，用于把对回放答案的反馈对应到原答案
+        self._answer_origins = LRUCache(self.SEMANTIC_CACHE_SIZE)
+        # 最近被反馈为错误的问题 id，有上限；被淘汰的 id 仍由数据库中的 feedback 判断
+        self._rejected_answers = LRUCache(self.SEMANTIC_CACHE_SIZE)
+        # 进行中的相同问题（无历史对话、答案缓存键相同）共享一次检索与生成
+        self.single_flight = SingleFlight()
+        # 取消统计：取消的回答数、已生成的 token 数，以及按完整回答的平均长度估算节省的 token 数
+        self.cancel_stats = {"cancelled": 0, "partial_tokens": 0, "tokens_saved": 0}
+        self._completed_answers = 0
+        self._completed_answer_tokens = 0
+        # 多个分片的检索并行执行
+        self._executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.shards)),
+                                            thread_name_prefix="retrieval")
         print("Chatbot 初始化完成！")
 
     def _init_database(self, db_path):
@@ -53,9 +152,14 @@ class Chatbot:
                     question TEXT NOT NULL,
                     answer TEXT NOT NULL,
                     feedback TEXT,
+                    status TEXT DEFAULT 'completed',
                     FOREIGN KEY (user_id) REFERENCES users(user_id)
                 )
             """)
+            # 旧数据库的问题表没有 status 列（completed / cancelled），补充该列
+            cursor.execute("PRAGMA table_info(questions)")
+            if "status" not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute("ALTER TABLE questions ADD COLUMN status TEXT DEFAULT 'completed'")
 
             # 检查表是否创建成功
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -73,31 +177,235 @@ class Chatbot:
         try:
             with open(json_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            return {item['title']: item['html_url'] for item in data if 'title' in item and 'html_url' in item}
+            return self._parse_url_map(data)
         except Exception as e:
             print(f"Error loading URL map: {e}")
             return {}
 
+    @staticmethod
+    def _parse_url_map(data):
+        return {item['title']: item['html_url'] for item in data if 'title' in item and 'html_url' in item}
+
+    def _load_shards(self, config_path):
+        """
+        加载所有语料分片。存在分片配置文件时按配置加载，
+        否则把 index_path / url_map_path 作为唯一的 SwanLab 分片（与单索引部署兼容）。
+        index_path 可以是索引目录，也可以是 index_bundle.py 打包的单文件索引包。
+        索引包校验失败或 embedding 模型与当前配置不一致时抛出 ValueError，不带着缺失的分片启动。
+        """
+        if os.path.exists(config_path):
+            shard_configs = load_shards_config(config_path)
+        else:
+            shard_configs = [{"name": "SwanLab", "index_path": self.FAISS_INDEX_PATH, "url_map_path": self.URL_MAP_PATH}]
+
+        shards = []
+        for config in shard_configs:
+            print(f"正在加载分片 '{config['name']}'...")
+            index_path = config['index_path']
+            is_bundle = os.path.isfile(index_path)
+            if is_bundle:
+                index, chunk_store, params, transform, bm25, url_map, version = self._load_bundle(index_path)
+                if url_map is None:
+                    url_map = self._load_url_map(config.get('url_map_path', self.URL_MAP_PATH))
+            else:
+                store = self._load_vector_store(index_path)
+                if store is None:
+                    continue
+                index, chunk_store, params, transform, bm25 = store
+                # 分片目录中自带的 URL 映射优先
+                url_map_path = os.path.join(index_path, URL_MAP_FILE)
+                if not os.path.exists(url_map_path):
+                    url_map_path = config.get('url_map_path', url_map_path)
+                url_map = self._load_url_map(url_map_path)
+                version = directory_version(index_path, params)
+            embedding_model = params.get("embedding_model")
+            if embedding_model and embedding_model != self.EMBEDDING_MODEL:
+                if is_bundle:
+                    raise ValueError(f"索引包 {index_path} 使用 embedding 模型 {embedding_model} 构建，"
+                                     f"与当前配置的 {self.EMBEDDING_MODEL} 不一致")
+                print(f"错误：分片 '{config['name']}' 使用 embedding 模型 {embedding_model} 构建，"
+                      f"与当前配置的 {self.EMBEDDING_MODEL} 不一致，已跳过。")
+                continue
+            # 原始 embedding 维度以构建时记录的为准，所有分片必须一致
+            dimension = params.get("dimension", self.VECTOR_DIMENSION)
+            if shards and dimension != self.VECTOR_DIMENSION:
+                if is_bundle:
+                    raise ValueError(f"索引包 {index_path} 的向量维度 {dimension} 与其他分片 ({self.VECTOR_DIMENSION}) 不一致")
+                print(f"错误：分片 '{config['name']}' 的向量维度 {dimension} 与其他分片 ({self.VECTOR_DIMENSION}) 不一致，已跳过。")
+                continue
+            self.VECTOR_DIMENSION = dimension
+            shards.append(CorpusShard(config['name'], index, chunk_store, url_map, params, transform, bm25,
+                                      config.get('keywords', ()), version))
+            print(f"分片 '{config['name']}' 的索引版本: {version}")
+        return shards
+
+    def _configure_search(self):
+        """设置 FAISS 的线程数，并为足够大的分片启用查询批处理。"""
+        num_threads = self.FAISS_OMP_THREADS
+        if num_threads is None:
+            num_threads = max(1, (os.cpu_count() or 1) // max(1, len(self.shards)))
+        num_threads = set_search_threads(num_threads)
+        batched = []
+        for shard in self.shards:
+            if self.SEARCH_BATCH_MIN_VECTORS is not None and shard.index.ntotal >= self.SEARCH_BATCH_MIN_VECTORS:
+                shard.enable_batching(self.SEARCH_BATCH_SIZE)
+                batched.append(shard.name)
+        print(f"FAISS OpenMP 线程数: {num_threads}，启用查询批处理的分片: {batched or '无'}")
+
+    def _load_bundle(self, bundle_path):
+        """打开单文件索引包，返回 (index, chunk_store, params, transform, bm25, url_map, 版本号)，校验失败时抛出 ValueError。"""
+        try:
+            bundle = IndexBundle(bundle_path)
+            index, params, transform = bundle.load_index()
+            chunk_store = bundle.chunk_store()
+            bm25 = bundle.bm25()
+            if bm25 is None:
+                print("索引包中没有 BM25 索引，正在从 chunk 存储构建...")
+                bm25 = BM25Index.build(chunk_store)
+            url_data = bundle.url_map_data()
+            url_map = self._parse_url_map(url_data) if url_data is not None else None
+            print(f"索引包加载成功（{params['index_type']}，{index.d} 维，构建于 {bundle.manifest['build_time']}），"
+                  f"包含 {index.ntotal} 个向量。")
+            return index, chunk_store, params, transform, bm25, url_map, bundle.bundle_id
+        except Exception as e:
+            raise ValueError(f"无法加载索引包 {bundle_path}: {e}") from e
+
     def _load_vector_store(self, index_path):
         try:
-            index_file = os.path.join(index_path, "index.faiss")
-            map_file = os.path.join(index_path, "index_to_chunk.json")
-            index = faiss.read_index(index_file)
-            with open(map_file, 'r', encoding='utf-8') as f:
-                index_to_chunk = json.load(f)
-            print(f"向量数据库加载成功，包含 {index.ntotal} 个向量。")
-            return index, index_to_chunk
+            # 加载索引并恢复构建时保存的搜索参数（IVF 的 nprobe、HNSW 的 efSearch 等）
+            index, params, transform = load_index(index_path)
+            if not ChunkStore.exists(index_path):
+                # 兼容旧版索引目录：首次加载时把 index_to_chunk.json 转换为 chunk 存储
+                map_file = os.path.join(index_path, "index_to_chunk.json")
+                print(f"未找到 chunk 存储，正在从 {map_file} 转换...")
+                convert_json(map_file, index_path)
+            chunk_store = ChunkStore.open(index_path)
+            if len(chunk_store) != index.ntotal:
+                raise ValueError(f"chunk 数量 ({len(chunk_store)}) 与向量数量 ({index.ntotal}) 不一致")
+            if not BM25Index.exists(index_path):
+                # 旧版索引目录没有 BM25 索引，首次加载时构建并保存
+                print("未找到 BM25 索引，正在从 chunk 存储构建...")
+                BM25Index.build(chunk_store).save(index_path)
+            bm25 = BM25Index.load(index_path)
+            print(f"向量数据库加载成功（{params['index_type']}，{index.d} 维），包含 {index.ntotal} 个向量。")
+            return index, chunk_store, params, transform, bm25
         except Exception as e:
             print(f"错误：无法加载向量数据库。错误: {e}")
-            return None, None
+            return None
+
+    def http_pool_stats(self):
+        """
+        上游连接池的使用情况：embedding 与同步 LLM 请求见 PooledSession.stats；
+        chat_async 为异步问答（界面使用的路径）的 aiohttp 连接池，按事件循环汇总。
+        """
+        return {"embedding": self.embedding_http.stats(), "chat": self.chat_http.stats(),
+                "chat_async": self._aiohttp_pool_stats()}
+
+    def _aiohttp_pool_stats(self):
+        """各事件循环上 aiohttp 连接池的上限、借出（in_use）与空闲（idle）连接数之和。"""
+        stats = {"sessions": 0, "maxsize": 0, "in_use": 0, "idle": 0}
+        for session in list(self._aiohttp_sessions.values()):
+            connector = session.connector
+            if session.closed or connector is None:
+                continue
+            stats["sessions"] += 1
+            stats["maxsize"] += connector.limit
+            # TCPConnector 没有公开的统计接口，读取其内部的连接表
+            stats["in_use"] += len(getattr(connector, "_acquired", ()))
+            stats["idle"] += sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return stats
 
     def _get_query_embedding(self, text):
+        """返回问题的原始维度 embedding，按 (模型, 规范化后的问题) 缓存。"""
+        cache_key = (self.EMBEDDING_MODEL, normalize_query(text))
+        embedding = self.query_embedding_cache.get(cache_key)
+        if embedding is None:
+            embedding = self.embedding_batcher(text)
+            # 缓存的向量被多个请求共享，设为只读
+            embedding.setflags(write=False)
+            self.query_embedding_cache.put(cache_key, embedding)
+        return embedding
+
+    async def _aget_query_embedding(self, text):
+        """_get_query_embedding 的异步版本，与其共用同一个缓存。"""
+        cache_key = (self.EMBEDDING_MODEL, normalize_query(text))
+        embedding = self.query_embedding_cache.get(cache_key)
+        if embedding is None:
+            embedding = await asyncio.wrap_future(self.embedding_batcher.submit(text))
+            embedding.setflags(write=False)
+            self.query_embedding_cache.put(cache_key, embedding)
+        return embedding
+
+    def _chat_session(self):
+        """当前事件循环上异步 LLM 请求的 aiohttp 会话，首次使用时创建（embedding 请求由批处理器通过 embedding_http 发送）。"""
+        loop = asyncio.get_running_loop()
+        session = self._aiohttp_sessions.get(loop)
+        if session is None or session.closed:
+            pool_size, timeout = self.ASYNC_CHAT_POOL_SIZE, self.CHAT_TIMEOUT
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size),
+                timeout=aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+            )
+            self._aiohttp_sessions[loop] = session
+        return session
+
+    async def aclose(self):
+        """关闭当前事件循环上的 aiohttp 会话，在事件循环结束前调用（例如 asyncio.run 的主协程退出前）。"""
+        session = self._aiohttp_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def close(self):
+        """
+        释放上游连接与后台线程：关闭各事件循环上的 aiohttp 会话、requests 连接池与批处理器。
+        不能在事件循环线程中调用（请改用 aclose）；已关闭的事件循环上的会话无法再关闭，直接丢弃。
+        """
+        for loop, session in list(self._aiohttp_sessions.items()):
+            if loop.is_closed() or session.closed:
+                continue
+            try:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=10)
+                else:
+                    loop.run_until_complete(session.close())
+            except Exception as e:
+                print(f"关闭 aiohttp 会话失败: {e}")
+        self._aiohttp_sessions.clear()
+        self.embedding_batcher.close()
+        for shard in self.shards:
+            if shard.search_batcher is not None:
+                shard.search_batcher.close()
+        self.embedding_http.close()
+        self.chat_http.close()
+        self._executor.shutdown(wait=False)
+
+    def _embedding_request(self, texts):
         headers = {"Authorization": f"Bearer {self.API_KEY}", "Content-Type": "application/json"}
         url = f"{self.BASE_URL.rstrip('/')}/embeddings"
-        payload = {"model": self.EMBEDDING_MODEL, "input": [text]}
-        response = requests.post(url, headers=headers, json=payload, timeout=10)
+        payload = {"model": self.EMBEDDING_MODEL, "input": texts}
+        return url, headers, payload
+
+    def _request_query_embeddings(self, texts):
+        """一次 /embeddings 请求获取一批问题的 embedding（由 embedding_batcher 调用），批内相同的问题只发送一次。"""
+        unique = list(dict.fromkeys(texts))
+        url, headers, payload = self._embedding_request(unique)
+        response = self.embedding_http.post(url, headers=headers, json=payload)
         response.raise_for_status()
-        return response.json()['data'][0]['embedding']
+        embeddings = self._parse_embeddings(response.json(), len(unique))
+        # 每个向量单独复制：切片是整批矩阵的视图，缓存中的一条会使整批矩阵无法释放，超出缓存的内存上限
+        rows = {text: embeddings[i].copy() for i, text in enumerate(unique)}
+        return [rows[text] for text in texts]
+
+    def _parse_embeddings(self, data, count):
+        # 按返回项的 index 排序，接口不保证与输入顺序一致
+        items = sorted(data['data'], key=lambda item: item.get('index', 0))
+        embeddings = np.array([item['embedding'] for item in items], dtype=np.float32)
+        if embeddings.shape[0] != count:
+            raise ValueError(f"请求 {count} 个 query embedding，返回了 {embeddings.shape[0]} 个")
+        if embeddings.shape[1] != self.VECTOR_DIMENSION:
+            raise ValueError(f"query embedding 维度为 {embeddings.shape[1]}，索引要求 {self.VECTOR_DIMENSION}")
+        # 降维变换（截断或 PCA）由各分片在搜索前按自己的构建参数完成
+        return embeddings
 
     def create_user(self, user_id):
         """创建新用户记录"""
@@ -175,15 +483,15 @@ class Chatbot:
         except sqlite3.Error as e:
             print(f"Database error incrementing question count: {e}")
 
-    def save_question(self, user_id, question, answer):
-        """保存问题记录"""
+    def save_question(self, user_id, question, answer, status="completed"):
+        """保存问题记录，status 为 completed 或 cancelled（回答中途被取消，answer 为已生成的部分）"""
         if not self.db:
             return None
         try:
             cursor = self.db.cursor()
             cursor.execute(
-                "INSERT INTO questions (user_id, question, answer) VALUES (?, ?, ?)",
-                (user_id, question, answer)
+                "INSERT INTO questions (user_id, question, answer, status) VALUES (?, ?, ?, ?)",
+                (user_id, question, answer, status)
             )
             self.db.commit()
             question_id = cursor.lastrowid
@@ -207,138 +515,483 @@ class Chatbot:
             )
             self.db.commit()
             print(f"Feedback saved: question_id={question_id}, feedback={feedback}")
+            if feedback == "incorrect":
+                # 被标记为错误的答案（包括从缓存回放的答案）不再被缓存复用
+                origin_id = self._answer_origins.get(question_id, question_id)
+                self._rejected_answers.put(origin_id, True)
+                self.semantic_cache.evict_question(origin_id)
             return f"感谢您的反馈！"
         except sqlite3.Error as e:
             print(f"Database error saving feedback: {e}")
             return "更新反馈失败。"
 
+    def _route(self, question, corpora=None):
+        """
+        选择本次查询要检索的分片：优先使用调用方指定的语料，
+        其次是问题中命中路由关键词的分片，都没有时检索全部分片。
+        """
+        if corpora:
+            selected = [shard for shard in self.shards if shard.name in corpora]
+        else:
+            selected = [shard for shard in self.shards if shard.matches(question)]
+        return selected or self.shards
+
     @staticmethod
-    def _extract_h1_title(text: str) -> str:
-        prefix = "一级标题："
-        for line in text.split('\n'):
-            if line.startswith(prefix):
-                return line[len(prefix):].strip()
-        return ""
-
-    def _keyword_search(self, query: str, k: int = 10):
-        keywords = [word for word in re.split(r'\W+', query.lower()) if word]
-        if not keywords:
-            return []
-
-        all_chunks = list(self.index_to_chunk.values())
-        chunk_scores = {}
-
-        for chunk in all_chunks:
-            score = 0
-            chunk_lower = chunk.lower()
-            for keyword in keywords:
-                score += chunk_lower.count(keyword)
-
-            if score > 0:
-                chunk_scores[chunk] = score
-
-        sorted_chunks = sorted(chunk_scores.items(), key=lambda item: item[1], reverse=True)
-        return [chunk for chunk, score in sorted_chunks[:k]]
-
-    def stream_chat(self, question, history, user_id):
-        if not self.index or not self.index_to_chunk:
-            yield "错误：向量数据库未加载。", None
-            return
+    def _timed(timings, name, func, *args):
+        """执行 func 并把耗时（毫秒）记录到 timings[name]。"""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            timings[name] = (time.perf_counter() - start) * 1000
 
-        # 检索阶段
-        query_embedding = self._get_query_embedding(question)
-        query_vector = np.array([query_embedding]).astype('float32')
-        distances, indices = self.index.search(query_vector, k=10)
-        vector_retrieved_chunks = [self.index_to_chunk[str(i)] for i in indices[0]]
+    def _start_keyword_search(self, question, shards, k, timings):
+        """关键词检索不依赖查询向量，提交到线程池，与 embedding 请求同时进行。"""
+        return [self._executor.submit(self._timed, timings, f"keyword:{shard.name}", shard.keyword_search, question, k)
+                for shard in shards]
 
-        keyword_retrieved_chunks = self._keyword_search(question, k=10)
+    @staticmethod
+    def _drop_futures(futures):
+        """缓存命中后不再需要的检索：尚未开始的取消，已开始的结果直接丢弃。"""
+        for future in futures:
+            future.cancel()
+
+    def _start_vector_search(self, query_embedding, shards, k, timings):
+        """
+        启用批处理的分片提交到其批处理器，与其他请求同时到达的查询合并为一次 index.search；
+        其余分片在线程池中直接检索。
+        """
+        start = time.perf_counter()
+        futures = []
+        for shard in shards:
+            if shard.search_batcher is None:
+                futures.append(self._executor.submit(self._timed, timings, f"vector:{shard.name}",
+                                                     shard.search, query_embedding, k))
+                continue
+            future = shard.submit_search(query_embedding, k)
+            future.add_done_callback(
+                lambda _, name=f"vector:{shard.name}": timings.__setitem__(name, (time.perf_counter() - start) * 1000))
+            futures.append(future)
+        return futures
 
-        # 合并与去重
+    @staticmethod
+    def _merge_hits(shards, vector_results, keyword_results, k, timings):
+        """
+        把各分片的两路检索结果按 RRF 融合，并按相关性截断（见 retrieval.py），
+        按融合得分降序返回去重后的 (分片, chunk id, chunk 文本) 列表。
+        不同分片的向量距离与 BM25 得分尺度不同，每个分片的每一路结果作为独立的排名列表参与融合。
+        """
+        merge_start = time.perf_counter()
+        vector_rankings = [[(distance, (shard, i)) for distance, i in hits[:k]]
+                           for shard, hits in zip(shards, vector_results)]
+        keyword_rankings = [[(score, (shard, i)) for score, i in hits[:k]]
+                            for shard, hits in zip(shards, keyword_results)]
+        fused = fuse_hits(vector_rankings, keyword_rankings)
+
+        # 去重（不同 id 可能对应相同的文本）
         combined_chunks = {}
-        all_retrieved = vector_retrieved_chunks + keyword_retrieved_chunks
-
-        for chunk in all_retrieved:
-            processed_chunk = chunk
-            if isinstance(chunk, list):
-                processed_chunk = "\n".join(chunk)
-
-            if isinstance(processed_chunk, str) and processed_chunk:
-                combined_chunks[processed_chunk] = None
-
-        retrieved_chunks = list(combined_chunks.keys())
-
-        # 标题分析
-        all_h1_titles = [self._extract_h1_title(chunk) for chunk in retrieved_chunks if self._extract_h1_title(chunk)]
-        title_counts = Counter(all_h1_titles)
+        for _, (shard, i) in fused:
+            chunk = shard.chunk_store[i]
+            if chunk and chunk not in combined_chunks:
+                combined_chunks[chunk] = (shard, i)
+        timings["merge"] = (time.perf_counter() - merge_start) * 1000
+        print(f"检索融合: 向量 {sum(map(len, vector_rankings))} + 关键词 {sum(map(len, keyword_rankings))} 个结果"
+              f"（{len(shards)} 个分片），保留 {len(combined_chunks)} 个 chunks")
+        return [(shard, i, chunk) for chunk, (shard, i) in combined_chunks.items()]
+
+    def _retrieve(self, question, shards, k=10, timings=None, keyword_futures=None):
+        """
+        在选中的分片上并行执行向量检索和关键词检索，各分片的结果按排名融合。
+        返回去重后的 (分片, chunk id, chunk 文本) 列表，向量检索结果在前；各阶段耗时记录在 timings 中。
+        keyword_futures 为调用方已经提交的关键词检索（例如在语义缓存查询之前提交），为 None 时在这里提交。
+        """
+        timings = {} if timings is None else timings
+        if keyword_futures is None:
+            keyword_futures = self._start_keyword_search(question, shards, k, timings)
+        query_embedding = self._timed(timings, "embedding", self._get_query_embedding, question)
+        vector_futures = self._start_vector_search(query_embedding, shards, k, timings)
+        return self._merge_hits(shards, [future.result() for future in vector_futures],
+                                [future.result() for future in keyword_futures], k, timings)
+
+    async def _aretrieve(self, question, shards, k=10, timings=None, keyword_futures=None):
+        """_retrieve 的异步版本：embedding 请求不阻塞事件循环，检索在线程池中执行。"""
+        timings = {} if timings is None else timings
+        if keyword_futures is None:
+            keyword_futures = self._start_keyword_search(question, shards, k, timings)
+        embedding_start = time.perf_counter()
+        query_embedding = await self._aget_query_embedding(question)
+        timings["embedding"] = (time.perf_counter() - embedding_start) * 1000
+        vector_futures = self._start_vector_search(query_embedding, shards, k, timings)
+        vector_results = await asyncio.gather(*(asyncio.wrap_future(future) for future in vector_futures))
+        keyword_results = await asyncio.gather(*(asyncio.wrap_future(future) for future in keyword_futures))
+        return self._merge_hits(shards, vector_results, keyword_results, k, timings)
+
+    def _answer_cache_key(self, question, shards):
+        """答案缓存键：LLM 模型、规范化后的问题以及检索分片的索引版本。"""
+        return self.LLM_MODEL, normalize_query(question), tuple((shard.name, shard.version) for shard in shards)
+
+    def _is_answer_eligible(self, question_id):
+        """缓存的答案是否还能复用：原问题记录存在且没有被反馈为错误。"""
+        if question_id in self._rejected_answers:
+            return False
+        if not self.db:
+            return True
+        try:
+            cursor = self.db.cursor()
+            cursor.execute("SELECT feedback FROM questions WHERE id = ?", (question_id,))
+            row = cursor.fetchone()
+            return row is not None and row[0] != "incorrect"
+        except sqlite3.Error as e:
+            print(f"Database error checking feedback: {e}")
+            return False
+
+    def _replay_answer(self, answer, sources_md, origin_id, question, user_id):
+        """按 stream_chat 的 (文本, question_id) 协议回放缓存的答案，同样保存问答记录。"""
+        yield answer, None
+        question_id = self.save_question(user_id, question, answer)
+        if question_id is not None:
+            self._answer_origins.put(question_id, origin_id)
+        if sources_md:
+            yield answer + sources_md, question_id
+
+    def _exact_cached_answer(self, answer_key):
+        """答案缓存中可以复用的 (答案, 参考资料, 原问题 id)，没有时返回 None。"""
+        cached = self.answer_cache.get(answer_key)
+        if cached is None:
+            return None
+        if not self._is_answer_eligible(cached[2]):
+            self.answer_cache.pop(answer_key)
+            return None
+        print(f"答案缓存命中（命中率 {self.answer_cache.hit_rate:.1%}）")
+        return cached
+
+    def _semantic_cached_answer(self, query_embedding, scope):
+        """语义缓存中与问题足够相似的答案，没有时返回 None。"""
+        hit = self.semantic_cache.lookup(query_embedding, scope, self._is_answer_eligible)
+        if hit is not None:
+            stats = self.semantic_cache.stats()
+            print(f"语义缓存命中（相似度 {hit['similarity']:.3f}，命中率 {stats['hit_rate']:.1%}，"
+                  f"累计节省 {stats['saved_latency_ms'] / 1000:.1f} s）")
+        return hit
+
+    def _build_prompt(self, question, history, retrieved):
+        """根据检索结果构建 Prompt，返回 (prompt, 参考资料的 (标题, URL) 列表)。"""
+        context, included, stats = pack_context(retrieved, self.CONTEXT_TOKEN_BUDGET)
+
+        # 标题分析（同名标题可能出现在不同分片中，按分片区分），只统计实际放入背景知识的 chunk
+        title_counts = Counter()
+        first_chunks = {}
+        for shard, i, _ in included:
+            title = shard.metadata.h1(i)
+            if title:
+                title_counts[(shard, title)] += 1
+                first_chunks.setdefault((shard, title), i)
         print(f"title_counts: {title_counts}")
-        top_titles = [title for title, count in title_counts.items() if count >= 2]
+        # 来源 URL 直接从 chunk 元数据中按 id 读取
+        top_titles = [(title, shard.metadata.url(first_chunks[shard, title]))
+                      for (shard, title), count in title_counts.items() if count >= 2]
         print(f"top_titles: {top_titles}")
 
-        # 构建Prompt
-        context = "\n\n---\n\n".join(retrieved_chunks)
         history_prompt = "".join([f"历史提问: {u}\n历史回答: {a}\n\n" for u, a in history])
 
-        prompt = f"""
-                # 角色
-                你是一个 SwanLab 开源项目的文档问答助手
-                #指令
-                1，根据提供的 [背景知识] 回答 [问题]。如果未找到任何相关的，则提醒用户未找到参考资料，根据你现有的知识给予意见。
-                2.回答时，叙述风格可以使用一些图标，使其更人性化。
-                3.回答完成后，可以反问用户一些相关的问题。
-                4.如果遇到一些网页地址存在不够完整，请在地址前面添加"https://docs.swanlab.cn/",并且把".md"替换为".html"。
-                ---
-                [背景知识]
-                {context}
-                ---
-                # 本次提问
-                [问题]
-                {question}
-                ---
-                你的回答:
-                """
+        prompt = PROMPT_TEMPLATE.format(context=context, question=question)
+        saved = stats["raw_tokens"] - stats["context_tokens"] + TEMPLATE_INDENT_TOKENS
+        print(f"Prompt 约 {estimate_tokens(prompt)} tokens：背景知识 {stats['included']}/{stats['chunks']} 个 chunks"
+              f"（{stats['documents']} 篇文档），{stats['raw_tokens']} -> {stats['context_tokens']} tokens，共节省约 {saved} tokens")
+        return prompt, top_titles
 
-        # 发送请求
+    def _chat_request(self, prompt):
+        """LLM 流式请求的 (url, headers, payload)。"""
         headers = {"Authorization": f"Bearer {self.API_KEY}", "Content-Type": "application/json"}
         url = f"{self.BASE_URL.rstrip('/')}/chat/completions"
         payload = {"model": self.LLM_MODEL, "messages": [{"role": "user", "content": prompt}], "stream": True}
+        return url, headers, payload
+
+    @staticmethod
+    def _parse_sse_line(decoded_line):
+        """解析一行 SSE 数据，返回 (是否结束, 增量文本)；不含文本的行返回 (False, None)。"""
+        if not decoded_line.startswith("data: "):
+            return False, None
+        json_str = decoded_line[len("data: "):]
+        if json_str.strip() == "[DONE]":
+            return True, None
+        try:
+            data = json.loads(json_str)
+        except json.JSONDecodeError:
+            return False, None
+        if 'choices' in data and data['choices'][0].get('delta', {}).get('content'):
+            return False, data['choices'][0]['delta']['content']
+        return False, None
+
+    def _finalize_answer(self, full_answer, top_titles, timings, request_start):
+        """一次生成结束时记录耗时与统计信息，返回参考资料 Markdown。"""
+        timings["total"] = (time.perf_counter() - request_start) * 1000
+        print("各阶段耗时(ms): " + ", ".join(f"{name}={ms:.1f}" for name, ms in timings.items()))
+        cache_stats = self.query_embedding_cache.stats()
+        print(f"查询向量缓存: 命中 {cache_stats['hits']} / {cache_stats['hits'] + cache_stats['misses']}"
+              f"（命中率 {cache_stats['hit_rate']:.1%}），{cache_stats['size']} 条，{cache_stats['bytes'] / 2 ** 20:.2f} MB")
+        print(f"上游连接池: {self.http_pool_stats()}")
+        print(f"合并请求: {self.single_flight.stats()}")
+        print(f"embedding 批处理: {self.embedding_batcher.stats()}")
+        search_stats = {shard.name: shard.search_batcher.stats() for shard in self.shards if shard.search_batcher}
+        if search_stats:
+            print(f"向量检索批处理: {search_stats}")
+        self._completed_answers += 1
+        self._completed_answer_tokens += estimate_tokens(full_answer)
+
+        # 格式化并添加参考资料
+        source_documents = []
+        for title, html_url in top_titles:
+            source_documents.append({"title": title, "html_url": html_url})
+
+        sources_md = ""
+        if source_documents:
+            sources_md = "\n\n---\n\n📚 **参考资料：**\n"
+            for doc in source_documents:
+                if doc.get('html_url'):
+                    sources_md += f"- [{doc['title']}]({doc['html_url']})\n"
+        return sources_md
+
+    def _save_answer(self, question, user_id, full_answer, sources_md, answer_key=None, scope=None,
+                     query_embedding=None, latency_ms=0.0):
+        """保存问答记录，答案可以缓存时写入答案缓存与语义缓存，返回 question_id。"""
+        question_id = self.save_question(user_id, question, full_answer)
+        # 合并的请求各自保存一条记录，缓存只写入最先保存的那条
+        if (answer_key is not None and full_answer and question_id is not None
+                and answer_key not in self.answer_cache):
+            self.answer_cache.put(answer_key, (full_answer, sources_md, question_id))
+            self.semantic_cache.add(query_embedding, question_id, full_answer, sources_md, scope, latency_ms)
+        return question_id
+
+    def _record_cancelled(self, question, user_id, partial_answer, request_start):
+        """回答被取消（用户清空对话或断开连接）时保存该用户已收到的部分。"""
+        self.save_question(user_id, question, partial_answer, status="cancelled")
+        partial_tokens = estimate_tokens(partial_answer)
+        self.cancel_stats["cancelled"] += 1
+        self.cancel_stats["partial_tokens"] += partial_tokens
+        print(f"回答已取消（{(time.perf_counter() - request_start):.1f} s，已生成约 {partial_tokens} tokens），"
+              f"取消统计: {self.cancel_stats}")
+
+    def _record_upstream_cancelled(self, partial_answer):
+        """
+        上游的 LLM 流被关闭时，按完整回答的平均长度估算节省的 token。
+        合并的请求中只有最后一个用户离开时上游才会被取消，其他用户离开时生成仍在继续，不计入节省。
+        """
+        average_tokens = self._completed_answer_tokens / self._completed_answers if self._completed_answers else 0
+        self.cancel_stats["tokens_saved"] += max(int(average_tokens) - estimate_tokens(partial_answer), 0)
+
+    def stream_chat(self, question, history, user_id, corpora=None):
+        if not self.shards:
+            yield "错误：向量数据库未加载。", None
+            return
+
+        # 检索阶段
+        request_start = time.perf_counter()
+        timings = {}
+        shards = self._route(question, corpora)
+        print(f"检索分片: {[shard.name for shard in shards]}")
+        # 答案只取决于问题和索引时（没有历史对话）才使用答案缓存
+        answer_key = None if history else self._answer_cache_key(question, shards)
+        query_embedding = scope = None
+        if answer_key is not None:
+            cached = self._exact_cached_answer(answer_key)
+            if cached is not None:
+                yield from self._replay_answer(*cached, question, user_id)
+                return
+
+        # 关键词检索不依赖查询向量，在语义缓存查询（需要请求 embedding）之前提交，两者同时进行
+        keyword_futures = self._start_keyword_search(question, shards, self.RETRIEVAL_K, timings)
+        if answer_key is not None:
+            # 语义缓存：相似问题的答案（查询向量会被缓存，之后的检索不会再次请求）
+            scope = (answer_key[0], answer_key[2])
+            query_embedding = self._timed(timings, "semantic_cache", self._get_query_embedding, question)
+            hit = self._semantic_cached_answer(query_embedding, scope)
+            if hit is not None:
+                self._drop_futures(keyword_futures)
+                yield from self._replay_answer(hit["answer"], hit["sources_md"], hit["question_id"],
+                                               question, user_id)
+                return
+        retrieved = self._retrieve(question, shards, self.RETRIEVAL_K, timings, keyword_futures)
+        timings["retrieval"] = (time.perf_counter() - request_start) * 1000
+        prompt, top_titles = self._build_prompt(question, history, retrieved)
+
+        # 发送请求
+        url, headers, payload = self._chat_request(prompt)
 
         # 流式处理响应
         full_answer = ""
         try:
-            with requests.post(url, headers=headers, json=payload, stream=True, timeout=100) as response:
+            with self.chat_http.post(url, headers=headers, json=payload, stream=True) as response:
                 response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith("data: "):
-                            json_str = decoded_line[len("data: "):]
-                            if json_str.strip() == "[DONE]":
+                try:
+                    for line in response.iter_lines():
+                        if line:
+                            done, token = self._parse_sse_line(line.decode('utf-8'))
+                            if done:
                                 break
-                            try:
-                                data = json.loads(json_str)
-                                if 'choices' in data and data['choices'][0].get('delta', {}).get('content'):
-                                    token = data['choices'][0]['delta']['content']
-                                    full_answer += token
-                                    yield full_answer, None
-                            except json.JSONDecodeError:
-                                continue
-
-            # 保存问答记录并获取ID
-            question_id = self.save_question(user_id, question, full_answer)
-
-            # 格式化并添加参考资料
-            source_documents = []
-            for title in top_titles:
-                html_url = self.url_map.get(title)
-                source_documents.append({"title": title, "html_url": html_url})
-
-            if source_documents:
-                sources_md = "\n\n---\n\n📚 **参考资料：**\n"
-                for doc in source_documents:
-                    if doc.get('html_url'):
-                        sources_md += f"- [{doc['title']}]({doc['html_url']})\n"
+                            if token:
+                                if not full_answer:
+                                    timings["first_token"] = (time.perf_counter() - request_start) * 1000
+                                full_answer += token
+                                yield full_answer, None
+                except GeneratorExit:
+                    # 调用方关闭了生成器：立即关闭上游连接，不再读取剩余的 token
+                    response.close()
+                    self._record_upstream_cancelled(full_answer)
+                    self._record_cancelled(question, user_id, full_answer, request_start)
+                    raise
+
+            sources_md = self._finalize_answer(full_answer, top_titles, timings, request_start)
+            question_id = self._save_answer(question, user_id, full_answer, sources_md, answer_key, scope,
+                                            query_embedding, timings["total"])
+            if sources_md:
                 full_answer += sources_md
                 yield full_answer, question_id
 
         except requests.exceptions.RequestException as e:
-            yield f"API 请求失败: {e}", None
\ No newline at end of file
+            yield f"API 请求失败: {e}", None
+
+    def _replay_deltas(self, answer, sources_md, origin_id, question, user_id):
+        """_replay_answer 产出完整文本，这里转换为增量。"""
+        sent = ""
+        for text, question_id in self._replay_answer(answer, sources_md, origin_id, question, user_id):
+            yield text[len(sent):], question_id
+            sent = text
+
+    async def _agenerate(self, question, history, shards, answer_key, request_start):
+        """
+        检索并生成答案，不保存问答记录，因此可以由多个相同的请求共享。依次产出：
+        ("replay", (答案, 参考资料, 原问题 id))  语义缓存命中；
+        ("token", 增量文本) ...  然后 ("final", (完整答案, 参考资料, 语义缓存范围, 查询向量, 耗时 ms))；
+        请求失败时为 ("error", 错误信息)。
+        """
+        timings = {}
+        query_embedding = scope = None
+        # 关键词检索不依赖查询向量，在语义缓存查询（需要请求 embedding）之前提交，两者同时进行
+        keyword_futures = self._start_keyword_search(question, shards, self.RETRIEVAL_K, timings)
+        if answer_key is not None:
+            # 语义缓存：相似问题的答案（查询向量会被缓存，之后的检索不会再次请求）
+            scope = (answer_key[0], answer_key[2])
+            embedding_start = time.perf_counter()
+            query_embedding = await self._aget_query_embedding(question)
+            timings["semantic_cache"] = (time.perf_counter() - embedding_start) * 1000
+            hit = self._semantic_cached_answer(query_embedding, scope)
+            if hit is not None:
+                self._drop_futures(keyword_futures)
+                yield "replay", (hit["answer"], hit["sources_md"], hit["question_id"])
+                return
+
+        retrieved = await self._aretrieve(question, shards, self.RETRIEVAL_K, timings, keyword_futures)
+        timings["retrieval"] = (time.perf_counter() - request_start) * 1000
+        prompt, top_titles = self._build_prompt(question, history, retrieved)
+
+        url, headers, payload = self._chat_request(prompt)
+        full_answer = ""
+        try:
+            session = self._chat_session()
+            async with session.post(url, headers=headers, json=payload) as response:
+                response.raise_for_status()
+                try:
+                    # response.content 按行迭代 SSE 数据
+                    async for line in response.content:
+                        line = line.strip()
+                        if line:
+                            done, token = self._parse_sse_line(line.decode('utf-8'))
+                            if done:
+                                break
+                            if token:
+                                if not full_answer:
+                                    timings["first_token"] = (time.perf_counter() - request_start) * 1000
+                                full_answer += token
+                                yield "token", token
+                except (GeneratorExit, asyncio.CancelledError):
+                    # 调用方关闭了生成器或任务被取消（合并的请求中所有用户都已离开）：立即关闭上游连接
+                    response.close()
+                    self._record_upstream_cancelled(full_answer)
+                    raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            yield "error", f"API 请求失败: {e}"
+            return
+
+        sources_md = self._finalize_answer(full_answer, top_titles, timings, request_start)
+        yield "final", (full_answer, sources_md, scope, query_embedding, timings["total"])
+
+    async def _astream_deltas(self, question, history, user_id, corpora=None):
+        """
+        异步问答的核心，产出 (增量文本, question_id)：依次为答案的各个 token，
+        最后是带 question_id 的参考资料（与 stream_chat 一样，没有参考资料时不产出 question_id）。
+        embedding 与 LLM 请求使用 aiohttp，检索在线程池中执行，等待上游时不占用线程。
+        同时进行中的相同问题只检索和生成一次，每个用户收到相同的 token，并各自保存问答记录。
+        """
+        if not self.shards:
+            yield "错误：向量数据库未加载。", None
+            return
+
+        request_start = time.perf_counter()
+        shards = self._route(question, corpora)
+        print(f"检索分片: {[shard.name for shard in shards]}")
+        # 答案只取决于问题和索引时（没有历史对话）才使用答案缓存，并与进行中的相同问题合并
+        answer_key = None if history else self._answer_cache_key(question, shards)
+        if answer_key is not None:
+            cached = self._exact_cached_answer(answer_key)
+            if cached is not None:
+                for item in self._replay_deltas(*cached, question, user_id):
+                    yield item
+                return
+
+        def generate():
+            return self._agenerate(question, history, shards, answer_key, request_start)
+
+        events = generate() if answer_key is None else self.single_flight.subscribe(answer_key, generate)
+        received = ""
+        result = None
+        try:
+            async for kind, value in events:
+                if kind == "token":
+                    received += value
+                    yield value, None
+                else:
+                    result = kind, value
+                    break
+        except (GeneratorExit, asyncio.CancelledError):
+            # 调用方关闭了生成器或任务被取消；合并的请求中其他用户仍在等待时，生成会继续进行
+            self._record_cancelled(question, user_id, received, request_start)
+            raise
+        finally:
+            await events.aclose()
+
+        kind, value = result
+        if kind == "replay":
+            for item in self._replay_deltas(*value, question, user_id):
+                yield item
+        elif kind == "error":
+            yield f"\n\n{value}" if received else value, None
+        else:
+            full_answer, sources_md, scope, query_embedding, latency_ms = value
+            question_id = self._save_answer(question, user_id, full_answer, sources_md, answer_key, scope,
+                                            query_embedding, latency_ms)
+            if sources_md:
+                yield sources_md, question_id
+
+    async def astream_chat(self, question, history, user_id, corpora=None):
+        """
+        stream_chat 的异步版本，产出 (完整文本, question_id)。
+        一个进程可以同时保持大量流式回答；界面上推荐使用只发送增量的 astream_chat_deltas。
+        """
+        full_text = ""
+        # aclosing：调用方关闭本生成器时同时关闭内层生成器，立即关闭上游连接，而不是等到垃圾回收
+        async with aclosing(self._astream_deltas(question, history, user_id, corpora)) as deltas:
+            async for delta, question_id in deltas:
+                full_text += delta
+                yield full_text, question_id
+
+    async def astream_chat_deltas(self, question, history, user_id, corpora=None,
+                                  frame_interval=STREAM_FRAME_INTERVAL):
+        """
+        产出 (增量文本, question_id)，token 按 frame_interval 秒的时间窗口合并为一帧，
+        调用方把各帧的增量依次拼接即得到完整答案。
+        """
+        deltas = self._astream_deltas(question, history, user_id, corpora)
+        async with aclosing(deltas), aclosing(coalesce_deltas(deltas, frame_interval)) as frames:
+            async for item in frames:
+                yield item
@@ -0,0 +1,122 @@
+import re
+
+import numpy as np
+
+from text_utils import estimate_tokens
+
+##chunk 的结构化元数据：加载索引时解析一次，请求路径上只做按 id 的数组查找
+# chunk 文本格式由 Search/documents_analyzer_url.py 生成：
+#   一级标题：xxx
+#   二级标题：xxx（没有时为 "无"）
+#   内容：
+#   ...
+H1_PREFIX = "一级标题："
+H2_PREFIX = "二级标题："
+CONTENT_MARKER = "内容："
+NO_TITLE = "无"
+
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+
+def parse_titles(text: str) -> tuple[str, str]:
+    """从 chunk 的头部解析 (一级标题, 二级标题)，缺失时为空字符串。"""
+    h1 = h2 = ""
+    for line in text.split('\n'):
+        if line.startswith(H1_PREFIX):
+            h1 = line[len(H1_PREFIX):].strip()
+        elif line.startswith(H2_PREFIX):
+            h2 = line[len(H2_PREFIX):].strip()
+            h2 = "" if h2 == NO_TITLE else h2
+        elif line.startswith(CONTENT_MARKER):
+            break
+    return h1, h2
+
+
+def chunk_body(text: str) -> str:
+    """去掉 chunk 的标题头部，只保留正文，并清理行尾空白和连续空行。"""
+    marker = text.find(CONTENT_MARKER)
+    body = text[marker + len(CONTENT_MARKER):] if marker >= 0 else text
+    body = "\n".join(line.rstrip() for line in body.strip().split('\n'))
+    return _BLANK_LINES.sub("\n\n", body)
+
+
+def section_heading(h2: str) -> str:
+    """打包到背景知识时二级标题的小节标题行。"""
+    return f"## {h2}\n" if h2 else ""
+
+
+class ChunkRecord:
+    __slots__ = ("chunk_id", "h1", "h2", "url", "token_length", "packed_tokens")
+
+    def __init__(self, chunk_id: int, h1: str, h2: str, url: str | None, token_length: int,
+                 packed_tokens: int):
+        self.chunk_id = chunk_id
+        self.h1 = h1
+        self.h2 = h2
+        self.url = url
+        self.token_length = token_length
+        self.packed_tokens = packed_tokens
+
+    def __repr__(self) -> str:
+        return f"ChunkRecord({self.chunk_id}, h1={self.h1!r}, h2={self.h2!r}, tokens={self.token_length})"
+
+
+class ChunkMetadata:
+    """
+    按 chunk id 保存标题、来源 URL、原文 token 数以及打包到背景知识后（小节标题 + 正文）的 token 数。
+    标题和 URL 去重后存为字符串表，每个 chunk 只占几个 int32，上万个 chunk 也只需几百 KB。
+    """
+
+    def __init__(self, strings: list[str], h1_ids: np.ndarray, h2_ids: np.ndarray, url_ids: np.ndarray,
+                 token_lengths: np.ndarray, packed_tokens: np.ndarray):
+        self.strings = strings
+        self.h1_ids = h1_ids
+        self.h2_ids = h2_ids
+        self.url_ids = url_ids
+        self.token_lengths = token_lengths
+        self.packed_tokens = packed_tokens
+
+    @classmethod
+    def build(cls, chunk_store, url_map: dict) -> "ChunkMetadata":
+        """遍历一次 chunk 存储构建元数据，来源 URL 按一级标题从 url_map 中查找。"""
+        strings, string_ids = [], {}
+
+        def intern(value):
+            if not value:
+                return -1
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            return string_ids[value]
+
+        count = len(chunk_store)
+        h1_ids = np.empty(count, dtype=np.int32)
+        h2_ids = np.empty(count, dtype=np.int32)
+        url_ids = np.empty(count, dtype=np.int32)
+        token_lengths = np.empty(count, dtype=np.int32)
+        packed_tokens = np.empty(count, dtype=np.int32)
+        for i, chunk in enumerate(chunk_store):
+            h1, h2 = parse_titles(chunk)
+            h1_ids[i] = intern(h1)
+            h2_ids[i] = intern(h2)
+            url_ids[i] = intern(url_map.get(h1))
+            token_lengths[i] = estimate_tokens(chunk)
+            packed_tokens[i] = estimate_tokens(section_heading(h2) + chunk_body(chunk))
+        return cls(strings, h1_ids, h2_ids, url_ids, token_lengths, packed_tokens)
+
+    def __len__(self) -> int:
+        return len(self.token_lengths)
+
+    def _string(self, string_id) -> str:
+        return self.strings[string_id] if string_id >= 0 else ""
+
+    def h1(self, i: int) -> str:
+        return self._string(self.h1_ids[i])
+
+    def url(self, i: int) -> str | None:
+        return self._string(self.url_ids[i]) or None
+
+    def __getitem__(self, i: int) -> ChunkRecord:
+        i = int(i)
+        return ChunkRecord(i, self._string(self.h1_ids[i]), self._string(self.h2_ids[i]),
+                           self.url(i), int(self.token_lengths[i]), int(self.packed_tokens[i]))
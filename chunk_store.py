@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import mmap
+
+import numpy as np
+
+# 文件布局：
+#   chunks.bin      所有 chunk 的 UTF-8 编码依次拼接
+#   chunks.offsets  little-endian uint64 数组，共 n + 1 项，第 i 个 chunk 位于 [offsets[i], offsets[i + 1])
+BLOB_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.offsets"
+OFFSET_DTYPE = np.dtype('<u8')
+
+
+class ChunkStore:
+    """
+    内存映射的只读 chunk 存储，按整数 id O(1) 取出 chunk 文本。
+    数据由操作系统按页加载，多个 worker 进程共享同一份物理内存。
+    """
+
+    def __init__(self, offsets: np.ndarray, blob):
+        self.offsets = offsets
+        self.blob = memoryview(blob)
+        self._mmaps = []
+
+    @classmethod
+    def open(cls, index_path: str) -> "ChunkStore":
+        offsets_path = os.path.join(index_path, OFFSETS_FILE)
+        blob_path = os.path.join(index_path, BLOB_FILE)
+        offsets = np.memmap(offsets_path, dtype=OFFSET_DTYPE, mode='r')
+        if len(offsets) == 0:
+            raise ValueError(f"chunk 偏移文件为空: {offsets_path}")
+
+        mmaps = []
+        if os.path.getsize(blob_path) > 0:
+            with open(blob_path, 'rb') as f:
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            mmaps.append(blob)
+        else:
+            blob = b""
+        if int(offsets[-1]) != len(blob):
+            raise ValueError(f"chunk 存储不完整：偏移表记录 {int(offsets[-1])} 字节，实际为 {len(blob)} 字节")
+
+        store = cls(offsets, blob)
+        store._mmaps = mmaps
+        return store
+
+    @staticmethod
+    def exists(index_path: str) -> bool:
+        return (os.path.exists(os.path.join(index_path, OFFSETS_FILE))
+                and os.path.exists(os.path.join(index_path, BLOB_FILE)))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_bytes(self, i: int) -> memoryview:
+        """返回第 i 个 chunk 的 UTF-8 字节切片（零拷贝）。"""
+        i = int(i)
+        if not 0 <= i < len(self):
+            raise IndexError(f"chunk id 越界: {i}")
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])]
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.get_bytes(i), 'utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self) -> None:
+        self.blob.release()
+        for m in self._mmaps:
+            m.close()
+        self._mmaps = []
+
+
+class ChunkStoreWriter:
+    """
+    以追加方式写入 chunk 存储。
+    传入 resume=count 时把文件截断到前 count 个 chunk 并继续追加，用于断点续建。
+    """
+
+    def __init__(self, index_path: str, resume: int | None = None):
+        offsets_path = os.path.join(index_path, OFFSETS_FILE)
+        blob_path = os.path.join(index_path, BLOB_FILE)
+        if resume is None:
+            self.count = 0
+            self.size = 0
+            self.blob_f = open(blob_path, 'wb')
+            self.offsets_f = open(offsets_path, 'wb')
+            self.offsets_f.write(np.array([0], dtype=OFFSET_DTYPE).tobytes())
+        else:
+            self.count = resume
+            offsets = np.fromfile(offsets_path, dtype=OFFSET_DTYPE, count=resume + 1)
+            if len(offsets) != resume + 1:
+                raise ValueError(f"chunk 存储中只有 {len(offsets) - 1} 个 chunk，无法从第 {resume} 个继续")
+            self.size = int(offsets[-1])
+            self.blob_f = open(blob_path, 'r+b')
+            self.blob_f.truncate(self.size)
+            self.blob_f.seek(self.size)
+            self.offsets_f = open(offsets_path, 'r+b')
+            self.offsets_f.truncate((resume + 1) * OFFSET_DTYPE.itemsize)
+            self.offsets_f.seek((resume + 1) * OFFSET_DTYPE.itemsize)
+
+    def write(self, chunks: list[str]) -> None:
+        ends = []
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            self.blob_f.write(data)
+            self.size += len(data)
+            ends.append(self.size)
+        self.offsets_f.write(np.array(ends, dtype=OFFSET_DTYPE).tobytes())
+        self.count += len(chunks)
+
+    def flush(self) -> None:
+        for f in (self.blob_f, self.offsets_f):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        self.blob_f.close()
+        self.offsets_f.close()
+
+
+def convert_json(json_path: str, index_path: str | None = None) -> int:
+    """
+    把旧版 index_to_chunk.json 转换为 chunk 存储，默认写到 JSON 所在的目录。
+    返回转换的 chunk 数量。
+    """
+    index_path = index_path or os.path.dirname(json_path)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        index_to_chunk = json.load(f)
+
+    chunks = []
+    for i in range(len(index_to_chunk)):
+        if str(i) not in index_to_chunk:
+            raise ValueError(f"{json_path} 中缺少 id {i}，无法按顺序转换")
+        chunk = index_to_chunk[str(i)]
+        # 兼容历史数据中以列表形式保存的 chunk
+        chunks.append("\n".join(chunk) if isinstance(chunk, list) else chunk)
+
+    writer = ChunkStoreWriter(index_path)
+    writer.write(chunks)
+    writer.close()
+    return len(chunks)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("用法: python chunk_store.py <index_to_chunk.json> [输出目录]")
+        sys.exit(1)
+    count = convert_json(*sys.argv[1:])
+    print(f"转换完成，共写入 {count} 个 chunks。")
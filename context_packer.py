@@ -0,0 +1,44 @@
+from chunk_metadata import chunk_body, section_heading
+from text_utils import estimate_tokens
+
+##把检索到的 chunk 打包为 Prompt 中的背景知识
+# - 按一级标题（同一篇文档）合并，每篇文档只写一次标题，二级标题作为小节；
+# - 去掉每个 chunk 重复的 "一级标题：/二级标题：/内容：" 头部和多余的空行；
+# - 按融合排序依次放入，超出 token 预算的 chunk 不再放入。
+# 每个 chunk 打包后的 token 数在加载索引时已算好（ChunkMetadata），请求路径上只有放入的 chunk 才处理正文。
+CONTEXT_TOKEN_BUDGET = 3000
+
+
+def pack_context(retrieved, budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    retrieved 为按相关性排序的 (分片, chunk id, chunk 文本) 列表。
+    返回 (背景知识文本, 实际放入的 retrieved 项, 统计信息)，统计信息包含原始与打包后的 token 数。
+    """
+    documents = {}  # (分片, 一级标题) -> [(二级标题, 正文)]，按首次出现的顺序
+    included = []
+    used_tokens = 0
+    raw_tokens = 0
+    for shard, i, chunk in retrieved:
+        record = shard.metadata[i]
+        raw_tokens += record.token_length
+        tokens = record.packed_tokens
+        if used_tokens + tokens > budget and included:
+            continue
+        body = chunk_body(chunk)
+        heading = section_heading(record.h2)
+        if used_tokens + tokens > budget:
+            # 第一个 chunk 就超出预算时截断，保证背景知识不为空
+            body = body[:max(budget - estimate_tokens(heading), 0)]
+            tokens = estimate_tokens(heading + body)
+        documents.setdefault((shard, record.h1), []).append((heading, body))
+        included.append((shard, i, chunk))
+        used_tokens += tokens
+
+    sections = []
+    for (_, h1), parts in documents.items():
+        title = f"# {h1}\n" if h1 else ""
+        sections.append(title + "\n\n".join(heading + body for heading, body in parts))
+    context = "\n\n---\n\n".join(sections)
+    stats = {"chunks": len(retrieved), "included": len(included), "documents": len(documents),
+             "raw_tokens": raw_tokens, "context_tokens": estimate_tokens(context)}
+    return context, included, stats
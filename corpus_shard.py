@@ -0,0 +1,110 @@
+import os
+import json
+import hashlib
+from concurrent.futures import Future
+
+import numpy as np
+
+from batching import MicroBatcher
+from chunk_metadata import ChunkMetadata
+
+# 多语料分片的配置文件，每项描述一个语料的索引目录、URL 映射和路由关键词，例如：
+# [
+#     {"name": "SwanLab", "index_path": "indexes/swanlab", "keywords": ["swanlab"]},
+#     {"name": "Transformers", "index_path": "indexes/transformers", "keywords": ["transformers", "hugging"]}
+# ]
+SHARDS_CONFIG_PATH = "indexes/shards.json"
+# 构建分片时一同保存的 URL 映射文件名
+URL_MAP_FILE = "url_map.json"
+
+
+def load_shards_config(config_path: str) -> list[dict]:
+    with open(config_path, 'r', encoding='utf-8') as f:
+        shards = json.load(f)
+    for shard in shards:
+        if 'name' not in shard or 'index_path' not in shard:
+            raise ValueError(f"分片配置缺少 name 或 index_path: {shard}")
+    return shards
+
+
+def directory_version(index_path: str, params: dict) -> str:
+    """索引目录的版本号：由 index.faiss 的大小、修改时间和构建时间决定，目录被重新构建后即改变。"""
+    stat = os.stat(os.path.join(index_path, "index.faiss"))
+    key = f"{stat.st_size}:{stat.st_mtime_ns}:{params.get('build_time')}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+class CorpusShard:
+    """
+    单个语料分片：FAISS 索引、chunk 存储、BM25 倒排索引、URL 映射以及查询向量需要经过的降维变换。
+    不同分片可以独立构建和更新，但必须使用同一个 embedding 模型。
+    version 标识当前加载的索引版本（索引包的 bundle_id 或目录的 directory_version）。
+    chunk 的标题、来源 URL 等元数据在创建分片时解析一次，保存在 metadata 中。
+    调用 enable_batching 后，submit_search 提交的并发查询会合并为一次 index.search。
+    """
+
+    def __init__(self, name, index, chunk_store, url_map, params, transform, bm25, keywords=(), version=None):
+        self.name = name
+        self.index = index
+        self.chunk_store = chunk_store
+        self.url_map = url_map
+        self.params = params
+        self.transform = transform
+        self.bm25 = bm25
+        self.keywords = [keyword.lower() for keyword in keywords]
+        self.version = version
+        self.metadata = ChunkMetadata.build(chunk_store, url_map)
+        self.search_batcher = None
+
+    def __repr__(self) -> str:
+        return self.name
+
+    def matches(self, question: str) -> bool:
+        """问题中是否出现了该分片的路由关键词。"""
+        question = question.lower()
+        return any(keyword in question for keyword in self.keywords)
+
+    def search(self, query_embedding: np.ndarray, k: int = 10) -> list[tuple[float, int]]:
+        """
+        向量检索，query_embedding 为原始维度的向量，按本分片的降维方式变换后再搜索。
+        返回 (L2 距离, chunk id) 列表。
+        """
+        return self.search_many([query_embedding], k)[0]
+
+    def search_many(self, query_embeddings, k: int = 10) -> list[list[tuple[float, int]]]:
+        """一次 index.search 检索多个查询向量，返回每个查询的 (L2 距离, chunk id) 列表。"""
+        query_vectors = self.transform.apply(np.stack(query_embeddings))
+        distances, indices = self.index.search(query_vectors, k)
+        # 结果不足 k 个时 FAISS 用 -1 填充
+        return [[(float(d), int(i)) for d, i in zip(row_distances, row_indices) if i >= 0]
+                for row_distances, row_indices in zip(distances, indices)]
+
+    def _search_batch(self, requests) -> list[list[tuple[float, int]]]:
+        # 同一批中 k 可能不同，按最大的 k 搜索后各自截取
+        k = max(request_k for _, request_k in requests)
+        results = self.search_many([query_embedding for query_embedding, _ in requests], k)
+        return [result[:request_k] for result, (_, request_k) in zip(results, requests)]
+
+    def enable_batching(self, max_batch_size: int = 64) -> None:
+        """
+        启用查询批处理：同一时刻只执行一次 index.search，执行期间到达的查询合并为下一批，空闲时的查询立即执行；
+        FAISS 的 OpenMP 线程在一次批量搜索内并行，而不是多个线程各自占满全部核心。
+        """
+        if self.search_batcher is None:
+            self.search_batcher = MicroBatcher(self._search_batch, max_batch_size, max_wait=0.0, max_concurrency=1,
+                                               name=f"search-{self.name}")
+
+    def submit_search(self, query_embedding: np.ndarray, k: int = 10) -> Future:
+        """提交一次向量检索，返回结果的 Future；未启用批处理时在当前线程中直接检索。"""
+        if self.search_batcher is not None:
+            return self.search_batcher.submit((query_embedding, k))
+        future = Future()
+        try:
+            future.set_result(self.search(query_embedding, k))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def keyword_search(self, query: str, k: int = 10) -> list[tuple[float, int]]:
+        """关键词检索，返回按 BM25 得分降序的 (得分, chunk id) 列表。"""
+        return self.bm25.search(query, k)
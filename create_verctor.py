@@ -1,15 +1,39 @@
 import os
 import json
-import requests
+import random
+import hashlib
+import argparse
+import shutil
+import itertools
+import asyncio
+import aiohttp
 import numpy as np
-import faiss
 import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from bm25_index import BM25_FILE, BM25Index
+from chunk_store import BLOB_FILE, OFFSETS_FILE, ChunkStore, ChunkStoreWriter
+from corpus_shard import URL_MAP_FILE
+from embedding_cache import EmbeddingCache
+from index_bundle import BUNDLE_SUFFIX, pack_bundle
+from text_utils import estimate_tokens
+from vector_index import (INDEX_TYPES, PARAMS_FILE, PCA_FILE, REDUCE_METHODS, VectorTransform, add_vectors,
+                          create_index, index_params, save_index_params, train_index, write_index)
 
 # --- 配置信息 ---
 # 源文档路径
 SOURCE_DOCUMENT_PATH = "Search/document_blocks.txt"
 # 本地向量数据库的保存路径
 FAISS_INDEX_PATH = "faiss_index_scratch_all"
+# embedding 缓存的保存路径，跨多次构建复用
+EMBEDDING_CACHE_PATH = "embedding_cache/embeddings.db"
+# 流式构建时每个窗口处理的 chunk 数，决定了构建过程的内存上限
+BUILD_WINDOW_SIZE = 1024
+# 构建过程中的临时目录（位于索引目录下），保存检查点和未完成的产物
+BUILD_DIR_NAME = "_build"
+# 构建完成后写入索引目录的文件
+OUTPUT_FILES = ["index.faiss", PARAMS_FILE, BLOB_FILE, OFFSETS_FILE, BM25_FILE, "vectors.npy"]
 
 # Embedding 模型配置
 EMBEDDING_MODEL = "填写Embedding模型"##Qwen/Qwen3-Embedding-0.6B
@@ -17,121 +41,412 @@ API_KEY = "填写API_KEY"
 BASE_URL = "填写API的base_url"
 VECTOR_DIMENSION = 1024  # 向量维度
 
+# 并发请求配置
+EMBEDDING_MAX_CONCURRENCY = 4  # 同时在途的请求数
+EMBEDDING_BATCH_TOKENS = 8000  # 单个批次的 token 预算（估算值）
+EMBEDDING_BATCH_MAX_ITEMS = 64  # 单个批次的最大条数，避免超出API单次请求的限制
+EMBEDDING_MAX_RETRIES = 5  # 单个批次的最大重试次数
+EMBEDDING_BACKOFF_BASE = 1.0  # 指数退避的基础等待时间（秒）
+EMBEDDING_BACKOFF_MAX = 60.0  # 指数退避单次等待的上限（秒），服务端给出的 Retry-After 不受此限制
+EMBEDDING_TIMEOUT = 60  # 单个请求的超时时间（秒）
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
 
 # --- 自定义函数 ---
 
-def load_text(file_path: str) -> str:
+def iter_chunks(file_path: str, separator: str = "################", block_size: int = 1 << 20):
     """
-    加载数据：从文件中读取全部文本内容。
+    流式加载并分割文档：按块读取文件，逐个产出 chunk，内存占用与文件大小无关。
+    结果与 split_text(完整文本) 完全一致。
     """
     with open(file_path, 'r', encoding='utf-8') as f:
-        return f.read()
+        pending = ""
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            pieces = (pending + block).split(separator)
+            # 最后一段可能被读取边界截断，留到下一轮再处理
+            pending = pieces.pop()
+            for piece in pieces:
+                if piece.strip():
+                    yield piece.strip()
+        if pending.strip():
+            yield pending.strip()
+
+
+def iter_windows(chunks, window_size: int, start: int = 0):
+    """把 chunk 流按固定大小分组，产出 (起始编号, chunk 列表)。"""
+    window = []
+    for chunk in chunks:
+        window.append(chunk)
+        if len(window) >= window_size:
+            yield start, window
+            start += len(window)
+            window = []
+    if window:
+        yield start, window
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """流式计算文件的 sha256，用于确认续建时源文档没有变化。"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
 
-def split_text(text: str, separator: str = "################") -> list[str]:
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    """原子地写入检查点文件，避免中途崩溃留下不完整的检查点。"""
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path: str, expected: dict) -> dict | None:
     """
-    分割文本：根据指定的分隔符分割文本。
+    读取检查点并核对构建配置（源文档、模型、维度、chunk 总数），
+    任何一项不一致都说明无法续建，返回 None。
     """
-    chunks = text.split(separator)
-    # 过滤掉可能存在的空字符串
-    return [chunk.strip() for chunk in chunks if chunk.strip()]
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    for key, value in expected.items():
+        if checkpoint.get(key) != value:
+            print(f"检查点中的 {key} 与当前构建不一致（{checkpoint.get(key)!r} != {value!r}），无法续建。")
+            return None
+    return checkpoint
 
 
-def get_embeddings_from_api(texts: list[str], batch_size: int = 16) -> list[list[float]]:
+def make_batches(texts: list[str],
+                 max_tokens: int = EMBEDDING_BATCH_TOKENS,
+                 max_items: int = EMBEDDING_BATCH_MAX_ITEMS) -> list[tuple[int, int]]:
+    """
+    切分批次：按 token 预算而不是固定条数把文本划分成若干批次。
+    返回 (start, end) 区间列表；单条超过预算的文本独占一个批次。
     """
-    获取api：直接调用 API 获取 embedding 向量。
-    处理了批量请求以提高效率并避免超出API单次请求的限制。
+    batches = []
+    start, batch_tokens = 0, 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if i > start and (batch_tokens + tokens > max_tokens or i - start >= max_items):
+            batches.append((start, i))
+            start, batch_tokens = i, 0
+        batch_tokens += tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _retry_delay(attempt: int, retry_after: str | None) -> float:
     """
-    all_embeddings = []
+    计算重试等待时间：优先遵循服务端的 Retry-After（按原值等待），否则使用带抖动、有上限的指数退避。
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                delay = 0.0
+        if delay > 0:
+            # 叠加少量抖动，避免所有批次在同一时刻重新涌入
+            return delay + random.uniform(0, EMBEDDING_BACKOFF_BASE)
+    return random.uniform(0, min(EMBEDDING_BACKOFF_MAX, EMBEDDING_BACKOFF_BASE * 2 ** attempt))
+
+
+async def _embed_batch(session: aiohttp.ClientSession,
+                       semaphore: asyncio.Semaphore,
+                       url: str,
+                       batch: list[str],
+                       stats: dict) -> list[list[float]]:
+    """
+    请求单个批次的 embedding，失败时只重试这一个批次。
+    429 和 5xx 视为可重试错误，其余错误直接抛出。
+    """
+    payload = {
+        "model": EMBEDDING_MODEL,
+        "input": batch
+    }
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            async with semaphore:
+                async with session.post(url, json=payload) as response:
+                    if response.status not in RETRYABLE_STATUS:
+                        response.raise_for_status()
+                        response_data = await response.json()
+                        # 按 index 排序，保证与输入顺序一致
+                        items = sorted(response_data['data'], key=lambda item: item.get('index', 0))
+                        return [item['embedding'] for item in items]
+                    retry_after = response.headers.get("Retry-After")
+                    error = f"HTTP {response.status}"
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error = repr(e)
+
+        if attempt == EMBEDDING_MAX_RETRIES:
+            raise RuntimeError(f"批次在重试 {EMBEDDING_MAX_RETRIES} 次后仍然失败: {error}")
+        delay = _retry_delay(attempt, retry_after)
+        stats["retries"] += 1
+        print(f"  批次请求失败（{error}），{delay:.1f}s 后进行第 {attempt + 1} 次重试...")
+        await asyncio.sleep(delay)
+
+
+async def _embed_all(texts: list[str], batches: list[tuple[int, int]], max_concurrency: int, stats: dict,
+                     on_batch=None):
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json"
     }
     url = f"{BASE_URL.rstrip('/')}/embeddings"
+    semaphore = asyncio.Semaphore(max_concurrency)
+    timeout = aiohttp.ClientTimeout(total=EMBEDDING_TIMEOUT)
+    done = 0
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        payload = {
-            "model": EMBEDDING_MODEL,
-            "input": batch
-        }
+    async def run(start: int, end: int):
+        nonlocal done
+        result = await _embed_batch(session, semaphore, url, texts[start:end], stats)
+        if on_batch is not None:
+            on_batch(texts[start:end], result)
+        done += 1
+        print(f"  已完成批次 {done} / {len(batches)}...")
+        return result
 
-        print(f"  正在处理批次 {i // batch_size + 1} / {len(texts) // batch_size + 1}...")
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
+        return await asyncio.gather(*(run(start, end) for start, end in batches))
 
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()  # 如果请求失败 (非 2xx 状态码), 则抛出异常
 
-            response_data = response.json()
-            batch_embeddings = [item['embedding'] for item in response_data['data']]
-            all_embeddings.extend(batch_embeddings)
+def get_embeddings_from_api(texts: list[str],
+                            max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+                            max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                            on_batch=None) -> list[list[float]]:
+    """
+    获取api：并发调用 API 获取 embedding 向量。
+    批次按 token 预算切分，同时在途的请求数不超过 max_concurrency；
+    遇到 429/5xx 时按 Retry-After 或抖动退避重试失败的批次。
+    on_batch(texts, embeddings) 在每个批次成功后立即回调，即使后续批次失败，已完成的结果也不会丢失。
+    """
+    if not texts:
+        return []
 
-        except requests.exceptions.RequestException as e:
-            print(f"错误：API 请求失败: {e}")
-            # 如果一个批次失败，可以选择停止或跳过
-            # 这里我们选择停止，因为数据不完整可能导致后续问题
-            raise
+    batches = make_batches(texts, max_tokens=max_batch_tokens)
+    stats = {"retries": 0}
+    print(f"  共 {len(texts)} 个 chunks，划分为 {len(batches)} 个批次，并发数 {max_concurrency}。")
 
-        # 速率限制，避免过于频繁地请求API
-        time.sleep(0.1)
+    start_time = time.perf_counter()
+    results = asyncio.run(_embed_all(texts, batches, max_concurrency, stats, on_batch))
+    elapsed = time.perf_counter() - start_time
 
+    all_embeddings = [embedding for batch_embeddings in results for embedding in batch_embeddings]
+    print(f"  Embedding 吞吐: {len(texts) / max(elapsed, 1e-9):.1f} chunks/s "
+          f"（耗时 {elapsed:.1f}s，重试 {stats['retries']} 次）")
     return all_embeddings
 
 
-def main():
+def get_embeddings_with_cache(chunks: list[str], cache: EmbeddingCache) -> np.ndarray:
+    """
+    带缓存地获取 embedding：命中缓存的 chunk 直接复用向量，
+    只有缓存中不存在的 chunk 才会调用 API，结果随后写回缓存。
+    返回形状为 (len(chunks), VECTOR_DIMENSION) 的 float32 数组。
+    """
+    embeddings = np.empty((len(chunks), VECTOR_DIMENSION), dtype=np.float32)
+    cached = cache.get_many(chunks)
+    # 相同内容的 chunk 只请求一次
+    missing = list(dict.fromkeys(chunk for chunk, vector in zip(chunks, cached) if vector is None))
+
+    def save_batch(texts, batch_embeddings):
+        if len(batch_embeddings) != len(texts):
+            raise RuntimeError("API 返回的向量数量与请求的 chunks 数量不匹配")
+        for vector in batch_embeddings:
+            if len(vector) != VECTOR_DIMENSION:
+                raise RuntimeError(f"API 返回的向量维度为 {len(vector)}，与配置的 {VECTOR_DIMENSION} 不一致")
+        # 每个批次完成后立即写入缓存，构建中断后重试时这些 chunk 会直接命中
+        cache.put_many(texts, batch_embeddings)
+
+    computed = {}
+    if missing:
+        new_embeddings = get_embeddings_from_api(missing, on_batch=save_batch)
+        computed = dict(zip(missing, new_embeddings))
+
+    for i, (chunk, vector) in enumerate(zip(chunks, cached)):
+        embeddings[i] = computed[chunk] if vector is None else vector
+    return embeddings
+
+
+def main(resume: bool = False, params: dict | None = None,
+         source_path: str = SOURCE_DOCUMENT_PATH, index_path: str = FAISS_INDEX_PATH,
+         url_map_path: str | None = None, bundle_path: str | None = None):
     """
     主函数，用于创建和保存向量数据库，不使用 LangChain。
+    文档以流式方式按窗口处理：每个窗口的向量写入磁盘上的 float32 memmap 并立即加入索引，
+    内存占用只与窗口大小有关，与语料规模无关。
+    每个窗口完成后写入检查点；resume=True 时从上次中断的位置继续，
+    最终生成的 index.faiss 和 chunk 存储与一次性构建的结果逐字节一致。
+    params 为 vector_index.index_params() 生成的索引参数，默认构建 flat 索引；
+    需要训练的索引（IVF 系列）在全部向量就绪后再训练并加入。
+    构建多语料分片时，为每个语料指定各自的 source_path / index_path，
+    并通过 url_map_path 把该语料的文档元数据（标题/URL）一并保存到分片目录中。
+    指定 bundle_path 时，构建完成后再把索引目录打包为单文件索引包。
     """
-    print("开始创建向量数据库 (从零开始)...")
+    params = params or index_params("flat")
+    params["embedding_model"] = EMBEDDING_MODEL
+    params["dimension"] = VECTOR_DIMENSION
+    print("开始创建向量数据库...")
+    if not os.path.exists(index_path):
+        os.makedirs(index_path)
 
-    # 1. 加载文档
-    print(f"正在从 '{SOURCE_DOCUMENT_PATH}' 加载文档...")
-    full_text = load_text(SOURCE_DOCUMENT_PATH)
-    print("文档加载完成。")
+    # 1. 统计 chunk 数量（流式扫描，不加载全文）
+    print(f"正在扫描 '{source_path}' 中的 chunks...")
+    total = sum(1 for _ in iter_chunks(source_path))
+    print(f"文档分割完成，共得到 {total} 个 chunks。")
 
-    # 2. 分割文档
-    print("正在分割文档成 chunks...")
-    chunks = split_text(full_text)
-    print(f"文档分割完成，共得到 {len(chunks)} 个 chunks。")
+    # 构建产物先写入临时目录，全部完成后再替换正式文件，避免服务读到不一致的索引
+    build_path = os.path.join(index_path, BUILD_DIR_NAME)
+    if not os.path.exists(build_path):
+        os.makedirs(build_path)
+    vectors_path = os.path.join(build_path, "vectors.npy")
+    checkpoint_path = os.path.join(build_path, "build_checkpoint.json")
+    build_config = {
+        "source_sha256": file_sha256(source_path),
+        "embedding_model": EMBEDDING_MODEL,
+        "dimension": VECTOR_DIMENSION,
+        "total_chunks": total,
+    }
 
-    # 3. 获取所有 chunks 的 embedding 向量
-    print("正在通过 API 获取所有 chunks 的 Embedding... (这可能需要一些时间)")
-    embeddings = get_embeddings_from_api(chunks)
-    print(f"Embedding 获取完成，共得到 {len(embeddings)} 个向量。")
+    checkpoint = load_checkpoint(checkpoint_path, build_config) if resume else None
+    if resume and checkpoint is None:
+        print("未找到可用的检查点，将从头开始构建。")
+    offset = checkpoint["chunk_offset"] if checkpoint else 0
 
-    if len(embeddings) != len(chunks):
-        print("错误：获取到的向量数量与 chunks 数量不匹配，程序终止。")
-        return
+    # 创建 L2 距离索引；索引和降维变换都不需要训练时可以边获取向量边加入
+    transform = VectorTransform.from_params(params, VECTOR_DIMENSION)
+    index = create_index(params, transform.output_dim, total)
+    incremental = index.is_trained and transform.is_trained
+    print(f"索引类型: {params['index_type']}，参数: {params}")
 
-    # 4. 创建并构建 FAISS 索引
-    print("正在创建 FAISS 索引...")
-    # 将 embedding 列表转换为 numpy 数组，FAISS 需要这种格式
-    vectors_np = np.array(embeddings).astype('float32')
+    # 2. 向量直接写入磁盘上的 .npy 文件（memmap），不在内存中累积
+    if checkpoint:
+        print(f"从检查点续建：已完成 {offset} / {total} 个 chunks。")
+        vectors = np.lib.format.open_memmap(vectors_path, mode='r+')
+        # 按与原构建相同的窗口边界把已完成的向量重新加入索引
+        if incremental:
+            for start in range(0, offset, BUILD_WINDOW_SIZE):
+                add_vectors(index, vectors[start:min(start + BUILD_WINDOW_SIZE, offset)], transform)
+        writer = ChunkStoreWriter(build_path, resume=offset)
+    else:
+        vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=np.float32,
+                                            shape=(total, VECTOR_DIMENSION))
+        writer = ChunkStoreWriter(build_path)
 
-    # 创建一个基础的 L2 距离索引
-    index = faiss.IndexFlatL2(VECTOR_DIMENSION)
+    # 3. 按窗口获取 embedding（优先复用缓存），逐批加入索引并写出 chunk 存储
+    print("正在获取所有 chunks 的 Embedding... (仅新增或修改过的 chunks 会调用 API)")
+    cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_MODEL, VECTOR_DIMENSION)
+    remaining = itertools.islice(iter_chunks(source_path), offset, None)
+    try:
+        for start, window in iter_windows(remaining, BUILD_WINDOW_SIZE, start=offset):
+            end = start + len(window)
+            vectors[start:end] = get_embeddings_with_cache(window, cache)
+            if incremental:
+                add_vectors(index, vectors[start:end], transform)
+            # 保存从索引ID到原始文本块的映射
+            # 这是至关重要的一步，因为 FAISS 只保存向量，不保存内容
+            writer.write(window)
 
-    # 将向量添加到索引中
-    index.add(vectors_np)
-    print(f"FAISS 索引创建完成，索引中包含 {index.ntotal} 个向量。")
+            # 写入检查点：先落盘向量和 chunk 存储，再记录进度
+            vectors.flush()
+            writer.flush()
+            save_checkpoint(checkpoint_path, {**build_config, "chunk_offset": end})
+            print(f"  已处理 {end} / {total} 个 chunks（检查点已保存）。")
+    except BaseException:
+        print("构建中断，已完成的进度保存在检查点中，可使用 --resume 继续。")
+        raise
+    finally:
+        writer.close()
+        cache.close()
+    vectors.flush()
+    print(f"Embedding 获取完成，缓存命中 {cache.hits} / {cache.hits + cache.misses}"
+          f"（命中率 {cache.hit_rate:.1%}）。")
 
-    # 5. 保存索引和内容映射到本地
-    print(f"正在保存索引和内容到本地文件夹: '{FAISS_INDEX_PATH}'...")
-    if not os.path.exists(FAISS_INDEX_PATH):
-        os.makedirs(FAISS_INDEX_PATH)
+    if not incremental:
+        print("正在训练索引...")
+        transform.train(vectors)
+        train_index(index, vectors, transform)
+        for start in range(0, total, BUILD_WINDOW_SIZE):
+            add_vectors(index, vectors[start:start + BUILD_WINDOW_SIZE], transform)
+    del vectors
 
-    # 保存 FAISS 索引文件
-    faiss.write_index(index, os.path.join(FAISS_INDEX_PATH, "index.faiss"))
+    if index.ntotal != total:
+        print("错误：获取到的向量数量与 chunks 数量不匹配，程序终止。")
+        return
+    print(f"FAISS 索引创建完成，索引中包含 {index.ntotal} 个向量。")
 
-    # 创建并保存从索引ID到原始文本块的映射
-    # 这是至关重要的一步，因为 FAISS 只保存向量，不保存内容
-    index_to_chunk = {i: chunk for i, chunk in enumerate(chunks)}
-    with open(os.path.join(FAISS_INDEX_PATH, "index_to_chunk.json"), 'w', encoding='utf-8') as f:
-        json.dump(index_to_chunk, f, ensure_ascii=False, indent=4)
+    # 关键词检索用的 BM25 倒排索引，从刚写好的 chunk 存储构建
+    chunk_store = ChunkStore.open(build_path)
+    bm25 = BM25Index.build(chunk_store)
+    chunk_store.close()
+    bm25.save(build_path)
+    print(f"BM25 索引创建完成，包含 {len(bm25.vocab)} 个词项。")
+
+    # 4. 保存索引和 chunk 存储到本地
+    print(f"正在保存索引和内容到本地文件夹: '{index_path}'...")
+    write_index(index, os.path.join(build_path, "index.faiss"))
+    params["build_time"] = datetime.now(timezone.utc).isoformat()
+    save_index_params(build_path, params)
+    transform.save(build_path)
+    output_files = OUTPUT_FILES + ([PCA_FILE] if transform.pca is not None else [])
+    if url_map_path:
+        shutil.copyfile(url_map_path, os.path.join(build_path, URL_MAP_FILE))
+        output_files.append(URL_MAP_FILE)
+    for name in output_files:
+        os.replace(os.path.join(build_path, name), os.path.join(index_path, name))
+    os.remove(checkpoint_path)
+    os.rmdir(build_path)
 
     print("向量数据库已成功保存！")
-    print(f"文件夹 '{FAISS_INDEX_PATH}' 中应包含 'index.faiss' 和 'index_to_chunk.json' 两个文件。")
+    print(f"文件夹 '{index_path}' 中应包含 {'、'.join(repr(name) for name in output_files)}。")
+
+    if bundle_path:
+        manifest = pack_bundle(index_path, bundle_path)
+        print(f"已打包为单文件索引包: '{bundle_path}'（版本 {manifest['bundle_id']}）")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="从文档块创建 FAISS 向量数据库")
+    parser.add_argument("--resume", action="store_true", help="从上次中断时保存的检查点继续构建")
+    parser.add_argument("--source", default=SOURCE_DOCUMENT_PATH, help="分块后的源文档路径")
+    parser.add_argument("--output", default=FAISS_INDEX_PATH, help="索引目录；多语料部署时每个语料一个目录")
+    parser.add_argument("--url-map", help="文档元数据 JSON（含 title / html_url），保存到索引目录中供引用来源使用")
+    parser.add_argument("--bundle", help=f"构建完成后打包为单文件索引包的路径（以 {BUNDLE_SUFFIX} 结尾）")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="索引类型")
+    parser.add_argument("--nlist", type=int, help="IVF 聚类中心数（默认按向量数量自动确定）")
+    parser.add_argument("--nprobe", type=int, help="IVF 查询时探测的聚类数")
+    parser.add_argument("--pq-m", type=int, help="IVF-PQ 的子空间数量，需能整除向量维度")
+    parser.add_argument("--pq-nbits", type=int, help="IVF-PQ 每个子空间的编码位数")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW 每个节点的邻居数")
+    parser.add_argument("--ef-construction", type=int, help="HNSW 构建时的候选队列长度")
+    parser.add_argument("--ef-search", type=int, help="HNSW 查询时的候选队列长度")
+    parser.add_argument("--rescore-k", type=int, help="二值索引召回后用原始向量精排的候选数")
+    parser.add_argument("--reduce-method", choices=REDUCE_METHODS, default="none",
+                        help="降维方式：truncate 为 Matryoshka 截断并重新归一化，pca 为构建时训练的 PCA")
+    parser.add_argument("--reduce-dim", type=int, help="降维后的向量维度，如 256 或 512")
+    args = parser.parse_args()
+    params = index_params(
+        args.index_type,
+        reduce_method=args.reduce_method,
+        reduce_dim=args.reduce_dim,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        pq_m=args.pq_m,
+        pq_nbits=args.pq_nbits,
+        hnsw_m=args.hnsw_m,
+        ef_construction=args.ef_construction,
+        ef_search=args.ef_search,
+        rescore_k=args.rescore_k,
+    )
+    main(resume=args.resume, params=params, source_path=args.source, index_path=args.output,
+         url_map_path=args.url_map, bundle_path=args.bundle)
@@ -0,0 +1,84 @@
+import os
+import hashlib
+import sqlite3
+
+import numpy as np
+
+
+def text_hash(text: str) -> str:
+    """计算 chunk 文本的 sha256，作为缓存键的一部分。"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    持久化的 embedding 缓存，键为 (embedding 模型, 向量维度, chunk 文本的 sha256)。
+    重建索引时只有新增或修改过的 chunk 才需要调用 API。
+    """
+
+    # SQLite 单条语句的参数个数有限制，批量查询时分段进行
+    _QUERY_BATCH = 500
+
+    def __init__(self, db_path: str, model: str, dimension: int):
+        self.model = model
+        self.dimension = dimension
+        self.hits = 0
+        self.misses = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dimension INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, dimension, text_hash)
+            ) WITHOUT ROWID
+        """)
+        self.conn.commit()
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """
+        批量查询缓存，返回与 texts 一一对应的向量，未命中的位置为 None。
+        """
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique_hashes), self._QUERY_BATCH):
+            part = unique_hashes[i:i + self._QUERY_BATCH]
+            placeholders = ",".join("?" * len(part))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings "
+                f"WHERE model = ? AND dimension = ? AND text_hash IN ({placeholders})",
+                (self.model, self.dimension, *part)
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        results = [found.get(key) for key in hashes]
+        hits = sum(1 for vector in results if vector is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    def put_many(self, texts: list[str], vectors) -> None:
+        """写入一批新计算的向量。"""
+        rows = [
+            (self.model, self.dimension, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, dimension, text_hash, vector) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        self.conn.commit()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,49 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PooledSession:
+    """
+    带连接池的 keep-alive HTTP 会话，同一主机的请求复用已建立的 TCP/TLS 连接。
+    pool_maxsize 为每个主机保持的最大连接数；pool_block=True 时连接用尽后排队等待，而不是临时创建不复用的新连接。
+    timeout 为默认的 (连接超时, 读取超时)，单次请求可以覆盖。
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 32, pool_block: bool = True,
+                 timeout: tuple[float, float] = (3.05, 30)):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        # 重试由调用方决定，连接池本身不重试
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block, max_retries=0)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        每个主机连接池的使用情况：created 为累计建立的连接数，requests 为累计请求数，
+        两者之比即连接复用率；in_use / idle 为当前借出和空闲的连接数。
+        """
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "created": pool.num_connections,
+                "requests": pool.num_requests,
+                "in_use": pool.pool.maxsize - pool.pool.qsize(),
+                "idle": idle,
+                "maxsize": pool.pool.maxsize,
+            }
+        return stats
+
+    def close(self) -> None:
+        self.session.close()
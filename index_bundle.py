@@ -0,0 +1,226 @@
+import os
+import json
+import mmap
+import struct
+import hashlib
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+import faiss
+
+from bm25_index import BM25_FILE, BM25Index
+from chunk_store import BLOB_FILE, OFFSET_DTYPE, OFFSETS_FILE, ChunkStore
+from corpus_shard import URL_MAP_FILE
+from vector_index import PCA_FILE, VectorTransform, load_index_params, prepare_index
+
+##单文件索引包：把索引、chunk 存储、URL 映射等打包为一个文件，部署和回滚只需替换这一个文件
+# 文件布局：
+#   [header 32 字节] magic(8) | 格式版本 uint32 | 保留 uint32 | manifest 偏移 uint64 | manifest 长度 uint64
+#   [各数据段]        每段按 64 字节对齐，便于直接以 numpy 数组的形式映射
+#   [manifest]        UTF-8 JSON：构建信息、各段的偏移/长度/sha256
+MAGIC = b"SWRAGBDL"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQQ")
+ALIGNMENT = 64
+# 小于该大小的数据段在加载时总是校验 sha256，大段只在 verify=True 时校验
+CHEAP_VERIFY_BYTES = 1 << 20
+BUNDLE_SUFFIX = ".ragbundle"
+
+
+def _copy_section(out, path: str, start: int = 0, block_size: int = 1 << 20) -> tuple[int, str]:
+    """把文件从 start 开始的内容流式复制到 out，返回 (字节数, sha256)。"""
+    digest = hashlib.sha256()
+    length = 0
+    with open(path, 'rb') as f:
+        f.seek(start)
+        for block in iter(lambda: f.read(block_size), b""):
+            out.write(block)
+            digest.update(block)
+            length += len(block)
+    return length, digest.hexdigest()
+
+
+def pack_bundle(index_path: str, bundle_path: str, url_map_path: str | None = None) -> dict:
+    """
+    把 create_verctor.py 构建的索引目录打包为单个文件，返回写入的 manifest。
+    先写入临时文件再原子替换，正在运行的服务不会读到写了一半的文件。
+    """
+    params = load_index_params(index_path)
+    offsets = np.fromfile(os.path.join(index_path, OFFSETS_FILE), dtype=OFFSET_DTYPE)
+
+    section_files = {
+        "index": os.path.join(index_path, "index.faiss"),
+        "chunk_offsets": os.path.join(index_path, OFFSETS_FILE),
+        "chunk_blob": os.path.join(index_path, BLOB_FILE),
+    }
+    url_map_path = url_map_path or os.path.join(index_path, URL_MAP_FILE)
+    if os.path.exists(url_map_path):
+        section_files["url_map"] = url_map_path
+    if os.path.exists(os.path.join(index_path, BM25_FILE)):
+        section_files["bm25"] = os.path.join(index_path, BM25_FILE)
+    if params.get("reduce_method") == "pca":
+        section_files["pca"] = os.path.join(index_path, PCA_FILE)
+    if params["index_type"] == "binary_rescore":
+        # 精排需要原始向量；.npy 的数据部分以原始 float32 行的形式保存
+        section_files["vectors"] = os.path.join(index_path, "vectors.npy")
+
+    tmp_path = bundle_path + ".tmp"
+    sections = {}
+    with open(tmp_path, 'wb') as out:
+        out.write(b"\0" * HEADER.size)
+        for name, path in section_files.items():
+            out.write(b"\0" * (-out.tell() % ALIGNMENT))
+            start, extra = 0, {}
+            if name == "vectors":
+                # 只复制 .npy 的数据部分（跳过文件头），加载时直接按 float32 映射
+                vectors = np.load(path, mmap_mode='r')
+                start, extra = vectors.offset, {"shape": list(vectors.shape)}
+                del vectors
+            offset = out.tell()
+            length, digest = _copy_section(out, path, start)
+            sections[name] = {"offset": offset, "length": length, "sha256": digest, **extra}
+
+        chunk_count = len(offsets) - 1
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "embedding_model": params.get("embedding_model"),
+            "dimension": params.get("dimension"),
+            "index_type": params["index_type"],
+            "chunk_count": chunk_count,
+            "build_time": params.get("build_time"),
+            "packed_time": datetime.now(timezone.utc).isoformat(),
+            "params": params,
+            "sections": sections,
+        }
+        # bundle_id 只由内容决定，用作索引版本号
+        manifest["bundle_id"] = hashlib.sha256(json.dumps(
+            {"params": params, "sections": {name: section["sha256"] for name, section in sections.items()}},
+            sort_keys=True
+        ).encode('utf-8')).hexdigest()[:16]
+
+        manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=4).encode('utf-8')
+        manifest_offset = out.tell()
+        out.write(manifest_bytes)
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, manifest_offset, len(manifest_bytes)))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_path, bundle_path)
+    return manifest
+
+
+class IndexBundle:
+    """
+    以 mmap 方式打开单文件索引包。打开时只做低成本的一致性检查：
+    文件头、各段边界、chunk 数量与偏移表、小数据段的 sha256；verify=True 时校验所有数据段。
+    任何不一致都会抛出 ValueError，服务在启动时即失败，不会带着损坏的索引运行。
+    """
+
+    def __init__(self, path: str, verify: bool = False):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.manifest = self._read_manifest()
+        self._check(verify)
+
+    def _read_manifest(self) -> dict:
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"{self.path} 不是有效的索引包：文件过短")
+        magic, version, _, manifest_offset, manifest_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} 不是有效的索引包：文件头不匹配")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} 的格式版本为 {version}，当前只支持 {FORMAT_VERSION}")
+        if manifest_offset + manifest_length != len(self._mmap):
+            raise ValueError(f"{self.path} 已损坏：文件长度与 manifest 记录不一致")
+        return json.loads(self._mmap[manifest_offset:manifest_offset + manifest_length].decode('utf-8'))
+
+    def _check(self, verify: bool) -> None:
+        manifest_offset = len(self._mmap) - HEADER.unpack_from(self._mmap, 0)[4]
+        for name, section in self.manifest["sections"].items():
+            if section["offset"] + section["length"] > manifest_offset:
+                raise ValueError(f"{self.path} 已损坏：数据段 {name} 越界")
+            if verify or section["length"] <= CHEAP_VERIFY_BYTES:
+                if hashlib.sha256(self.section(name)).hexdigest() != section["sha256"]:
+                    raise ValueError(f"{self.path} 已损坏：数据段 {name} 的 sha256 不匹配")
+
+        offsets = self._chunk_offsets()
+        if len(offsets) != self.manifest["chunk_count"] + 1:
+            raise ValueError(f"{self.path} 已损坏：chunk 偏移表长度与 chunk 数量不一致")
+        if int(offsets[-1]) != self.manifest["sections"]["chunk_blob"]["length"]:
+            raise ValueError(f"{self.path} 已损坏：chunk 偏移表与 chunk 数据长度不一致")
+
+    @property
+    def bundle_id(self) -> str:
+        return self.manifest["bundle_id"]
+
+    def section(self, name: str) -> memoryview:
+        """返回数据段的零拷贝视图。"""
+        section = self.manifest["sections"][name]
+        return memoryview(self._mmap)[section["offset"]:section["offset"] + section["length"]]
+
+    def _chunk_offsets(self) -> np.ndarray:
+        return np.frombuffer(self.section("chunk_offsets"), dtype=OFFSET_DTYPE)
+
+    def load_index(self):
+        """反序列化索引并应用搜索参数，返回 (index, params, transform)。"""
+        params = self.manifest["params"]
+        transform = VectorTransform.deserialize(params, self.section("pca") if "pca" in self.manifest["sections"] else b"")
+        data = np.frombuffer(self.section("index"), dtype=np.uint8)
+        vectors = None
+        if params["index_type"] == "binary_rescore":
+            index = faiss.deserialize_index_binary(data)
+            vectors = np.frombuffer(self.section("vectors"), dtype=np.float32).reshape(
+                self.manifest["sections"]["vectors"]["shape"])
+        else:
+            index = faiss.deserialize_index(data)
+        if index.ntotal != self.manifest["chunk_count"]:
+            raise ValueError(f"{self.path} 已损坏：索引中有 {index.ntotal} 个向量，manifest 记录 {self.manifest['chunk_count']} 个")
+        return prepare_index(index, params, transform, vectors), params, transform
+
+    def chunk_store(self) -> ChunkStore:
+        return ChunkStore(self._chunk_offsets(), self.section("chunk_blob"))
+
+    def bm25(self) -> BM25Index | None:
+        """返回打包的 BM25 索引，旧版索引包中没有时返回 None。"""
+        if "bm25" not in self.manifest["sections"]:
+            return None
+        return BM25Index.deserialize(self.section("bm25"))
+
+    def url_map_data(self):
+        """返回打包的文档元数据（与 swanlab_docs_Internet8-2.json 格式相同），没有时返回 None。"""
+        if "url_map" not in self.manifest["sections"]:
+            return None
+        return json.loads(bytes(self.section("url_map")).decode('utf-8'))
+
+    def close(self) -> None:
+        self._mmap.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单文件索引包的打包与检查")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack = subparsers.add_parser("pack", help="把索引目录打包为单个文件")
+    pack.add_argument("index_path", help="create_verctor.py 生成的索引目录")
+    pack.add_argument("bundle_path", help=f"输出文件，建议以 {BUNDLE_SUFFIX} 结尾")
+    pack.add_argument("--url-map", help="文档元数据 JSON，默认使用索引目录中的 url_map.json")
+    info = subparsers.add_parser("info", help="打印索引包的 manifest")
+    info.add_argument("bundle_path")
+    verify = subparsers.add_parser("verify", help="完整校验索引包中所有数据段的 sha256")
+    verify.add_argument("bundle_path")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        manifest = pack_bundle(args.index_path, args.bundle_path, args.url_map)
+        print(f"打包完成: {args.bundle_path}（版本 {manifest['bundle_id']}，{manifest['chunk_count']} 个 chunks）")
+    else:
+        bundle = IndexBundle(args.bundle_path, verify=args.command == "verify")
+        manifest = {key: value for key, value in bundle.manifest.items() if key != "params"}
+        print(json.dumps(manifest, ensure_ascii=False, indent=4))
+        if args.command == "verify":
+            print("校验通过。")
+
+
+if __name__ == "__main__":
+    main()
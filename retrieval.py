@@ -0,0 +1,46 @@
+##向量检索与关键词检索结果的融合
+# 两路结果的得分不可直接比较（L2 距离 vs BM25 得分），不同分片之间也不可比较：
+# 各分片的降维方式（PCA / 截断）和索引类型（PQ / SQ）不同，L2 距离的尺度不同；各语料的 BM25 idf 也不同。
+# 因此每个分片的每一路结果都作为一个独立的排名列表，按排名做 reciprocal rank fusion（RRF）：
+#   score = Σ 1 / (RRF_K + rank)
+# 再在每个列表内按各自的得分做截断：向量距离明显差于该列表最优结果、或 BM25 得分远低于该列表最高分的结果视为不相关，
+# 只有少数 chunk 真正相关时上下文随之变小，但至少保留 MIN_CONTEXT_CHUNKS 个。
+RRF_K = 60
+MAX_CONTEXT_CHUNKS = 8
+MIN_CONTEXT_CHUNKS = 2
+# 向量结果的距离不超过同一列表最优距离的 (1 + VECTOR_DISTANCE_SLACK) 倍
+VECTOR_DISTANCE_SLACK = 0.5
+# 关键词结果的得分不低于同一列表最高分的 KEYWORD_SCORE_RATIO
+KEYWORD_SCORE_RATIO = 0.3
+
+
+def fuse_hits(vector_rankings, keyword_rankings, max_k: int = MAX_CONTEXT_CHUNKS, min_k: int = MIN_CONTEXT_CHUNKS,
+              rrf_k: int = RRF_K, distance_slack: float = VECTOR_DISTANCE_SLACK,
+              keyword_ratio: float = KEYWORD_SCORE_RATIO) -> list[tuple[float, object]]:
+    """
+    融合多个排名列表（通常每个分片各一个向量列表和一个关键词列表）。
+    vector_rankings 中每个列表为按距离升序的 (距离, key)，keyword_rankings 中每个列表为按得分降序的 (得分, key)，
+    key 为任意可哈希的结果标识，只在同一列表内比较得分。
+    返回按融合得分降序的 (得分, key) 列表，长度在 [min_k, max_k] 之间（结果足够时）。
+    """
+    scores = {}
+    for ranking in (*vector_rankings, *keyword_rankings):
+        for rank, (_, key) in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    fused = sorted(((score, key) for key, score in scores.items()), key=lambda item: item[0], reverse=True)
+
+    relevant = set()
+    for ranking in vector_rankings:
+        if ranking:
+            max_distance = ranking[0][0] * (1 + distance_slack) + 1e-6
+            relevant.update(key for distance, key in ranking if distance <= max_distance)
+    for ranking in keyword_rankings:
+        if ranking:
+            min_score = ranking[0][0] * keyword_ratio
+            relevant.update(key for score, key in ranking if score >= min_score)
+
+    selected = [item for item in fused if item[1] in relevant][:max_k]
+    if len(selected) < min_k:
+        selected += [item for item in fused if item[1] not in relevant][:min_k - len(selected)]
+        selected.sort(key=lambda item: item[0], reverse=True)
+    return selected
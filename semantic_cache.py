@@ -0,0 +1,112 @@
+import time
+import threading
+
+import numpy as np
+import faiss
+
+
+class SemanticCache:
+    """
+    语义答案缓存：对历史问题的 embedding 建一个小型内积索引（向量归一化后即余弦相似度），
+    新问题与某条历史问题的相似度不低于 threshold 时直接复用其答案。
+    每条缓存带有 scope（LLM 模型与索引版本），只有 scope 相同的条目才会命中；条目超过 ttl 秒后过期。
+    每个 scope 使用单独的索引，其他 scope（例如重建前的旧版本索引）的相似条目不会占用候选名额。
+    """
+
+    def __init__(self, dimension: int, threshold: float = 0.92, ttl: float = 7 * 24 * 3600,
+                 maxsize: int = 10000, candidates: int = 5):
+        self.dimension = dimension
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.candidates = candidates
+        self.indexes = {}  # scope -> faiss.IndexIDMap2
+        self.entries = {}  # 缓存 id -> dict(question_id, answer, sources_md, scope, created, latency_ms)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.saved_latency_ms = 0.0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.array(embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, embedding: np.ndarray, scope, is_eligible=None) -> dict | None:
+        """
+        查找与 embedding 足够相似且 scope 相同的缓存答案，没有时返回 None。
+        is_eligible(question_id) 返回 False 的条目（例如被标记为错误的答案）会被移除。
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            self.lookups += 1
+            index = self.indexes.get(scope)
+            if index is None:
+                return None
+            similarities, ids = index.search(vector, min(self.candidates, index.ntotal))
+            candidates = [(float(s), int(i)) for s, i in zip(similarities[0], ids[0]) if i >= 0]
+
+        now = time.time()
+        for similarity, cache_id in candidates:
+            if similarity < self.threshold:
+                break
+            entry = self.entries.get(cache_id)
+            if entry is None:
+                continue
+            if now - entry["created"] > self.ttl or (is_eligible and not is_eligible(entry["question_id"])):
+                self._remove(cache_id)
+                continue
+            with self._lock:
+                self.hits += 1
+                self.saved_latency_ms += entry["latency_ms"]
+            return dict(entry, similarity=similarity)
+        return None
+
+    def add(self, embedding: np.ndarray, question_id: int, answer: str, sources_md: str, scope,
+            latency_ms: float) -> None:
+        vector = self._normalize(embedding)
+        with self._lock:
+            cache_id = self._next_id
+            self._next_id += 1
+            index = self.indexes.get(scope)
+            if index is None:
+                index = self.indexes[scope] = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+            index.add_with_ids(vector, np.array([cache_id], dtype=np.int64))
+            self.entries[cache_id] = {"question_id": question_id, "answer": answer, "sources_md": sources_md,
+                                      "scope": scope, "created": time.time(), "latency_ms": latency_ms}
+            # 超出容量时淘汰最早加入的条目（字典保持插入顺序）
+            while len(self.entries) > self.maxsize:
+                self._remove_locked(next(iter(self.entries)))
+
+    def evict_question(self, question_id: int) -> int:
+        """移除指定问题记录对应的缓存条目，返回移除的数量。"""
+        with self._lock:
+            cache_ids = [cache_id for cache_id, entry in self.entries.items() if entry["question_id"] == question_id]
+            for cache_id in cache_ids:
+                self._remove_locked(cache_id)
+        return len(cache_ids)
+
+    def _remove(self, cache_id: int) -> None:
+        with self._lock:
+            self._remove_locked(cache_id)
+
+    def _remove_locked(self, cache_id: int) -> None:
+        entry = self.entries.pop(cache_id, None)
+        if entry is not None:
+            index = self.indexes[entry["scope"]]
+            index.remove_ids(np.array([cache_id], dtype=np.int64))
+            if index.ntotal == 0:
+                del self.indexes[entry["scope"]]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "scopes": len(self.indexes), "lookups": self.lookups, "hits": self.hits, "hit_rate": self.hit_rate,
+                "saved_latency_ms": self.saved_latency_ms}
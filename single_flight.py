@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+##相同问题的并发请求合并（single-flight）
+# 多个用户同时提出相同的问题（无历史、归一化后相同）时，只向上游发起一次检索与 LLM 请求，
+# 生成的 token 同时推送给所有等待的用户。
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class _Flight:
+    def __init__(self, loop):
+        self.loop = loop
+        self.task = None
+        self.items = []        # 已产出的全部项，供中途加入的订阅者补齐
+        self.subscribers = []  # (事件循环, asyncio.Queue)
+
+
+class SingleFlight:
+    """
+    合并相同 key 的并发异步流：第一个请求启动生产任务，之后到达的相同 key 的请求订阅同一个任务，
+    所有订阅者按相同顺序收到相同的项（中途加入的先补齐已产出的部分）。
+    生产任务独立于任何单个订阅者，只有全部订阅者都离开时才会被取消。
+    订阅者可以位于不同线程的事件循环中，项通过 call_soon_threadsafe 投递。
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def subscribe(self, key, factory):
+        """订阅 key 对应的流；没有进行中的流时调用 factory() 创建异步生成器并启动。"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        subscriber = (loop, queue)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(loop)
+                self._flights[key] = flight
+                self.started += 1
+            else:
+                self.joined += 1
+            backlog = list(flight.items)
+            flight.subscribers.append(subscriber)
+        if leader:
+            flight.task = loop.create_task(self._produce(key, flight, factory()))
+
+        try:
+            for item in backlog:
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            with self._lock:
+                flight.subscribers.remove(subscriber)
+                abandoned = not flight.subscribers and self._flights.get(key) is flight
+                if abandoned:
+                    del self._flights[key]
+            if abandoned and flight.task is not None:
+                flight.loop.call_soon_threadsafe(flight.task.cancel)
+
+    def _publish(self, flight, item) -> None:
+        with self._lock:
+            flight.items.append(item)
+            subscribers = list(flight.subscribers)
+        for loop, queue in subscribers:
+            if loop is flight.loop:
+                queue.put_nowait(item)
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    async def _produce(self, key, flight, source) -> None:
+        try:
+            async for item in source:
+                self._publish(flight, item)
+            final = _END
+        except Exception as e:
+            final = _Failure(e)
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        self._publish(flight, final)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "started": self.started, "joined": self.joined}
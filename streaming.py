@@ -0,0 +1,75 @@
+import asyncio
+
+##流式输出的合帧：把逐 token 的增量按时间窗口合并，每帧只发送新增的文本
+# 逐 token 发送完整答案时，每帧的大小随答案长度增长，总工作量与答案长度成平方关系；
+# 合帧后帧数只与回答时长有关（约 时长 / 帧间隔），每帧只包含增量。
+STREAM_FRAME_INTERVAL = 0.04
+
+_END = object()
+
+
+async def coalesce_deltas(deltas, interval: float = STREAM_FRAME_INTERVAL):
+    """
+    把 (增量文本, question_id) 的异步序列按 interval 秒的时间窗口合并。
+    窗口内的文本合并为一帧；带 question_id 的项不合并，先发出已积累的文本再原样发出。
+    上游暂时没有新 token 时，窗口到期也会发出已积累的文本，不会等到下一个 token。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    error = None
+
+    async def produce():
+        nonlocal error
+        try:
+            async for item in deltas:
+                queue.put_nowait(item)
+        except Exception as e:
+            error = e
+        finally:
+            queue.put_nowait(_END)
+
+    producer = asyncio.ensure_future(produce())
+    pending = ""
+    deadline = 0.0
+    try:
+        while True:
+            if pending:
+                if loop.time() >= deadline:
+                    yield pending, None
+                    pending = ""
+                    continue
+                if queue.empty():
+                    # asyncio.timeout 需要 Python 3.11，这里用 wait_for 以兼容 3.10
+                    try:
+                        item = await asyncio.wait_for(queue.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        continue
+                else:
+                    item = queue.get_nowait()
+            else:
+                item = await queue.get()
+            if item is _END:
+                break
+
+            delta, question_id = item
+            if question_id is not None:
+                if pending:
+                    yield pending, None
+                    pending = ""
+                yield delta, question_id
+                continue
+            if not pending:
+                deadline = loop.time() + interval
+            pending += delta
+        if pending:
+            yield pending, None
+        if error is not None:
+            raise error
+    finally:
+        # 消费方提前结束（例如用户取消）时，取消读取上游，上游生成器中的 async with 会关闭连接
+        if not producer.done():
+            producer.cancel()
+            try:
+                await producer
+            except asyncio.CancelledError:
+                pass
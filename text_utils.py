@@ -0,0 +1,22 @@
+import re
+import unicodedata
+
+# 中日韩统一表意文字及常用全角标点，近似按 1 字 1 token 计算
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿豈-﫿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的 token 数：CJK 字符按 1 个 token 计，其余字符按约 4 个字符 1 个 token 计。
+    只用于切分批次和控制预算，不追求与具体 tokenizer 完全一致。
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def normalize_query(text: str) -> str:
+    """规范化用户问题，用作缓存键：全角转半角、统一小写、合并空白。"""
+    return " ".join(unicodedata.normalize('NFKC', text).lower().split())
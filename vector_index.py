@@ -0,0 +1,320 @@
+import os
+import json
+import math
+
+import numpy as np
+import faiss
+
+# 索引参数与 index.faiss 保存在同一目录，查询端据此恢复搜索参数
+PARAMS_FILE = "index_params.json"
+# 降维使用的 PCA 矩阵，构建时训练，查询时对 query 向量做同样的变换
+PCA_FILE = "pca.bin"
+
+REDUCE_METHODS = ("none", "truncate", "pca")
+
+INDEX_TYPES = ("flat", "sq_fp16", "sq8", "ivf_flat", "ivf_pq", "hnsw", "binary_rescore")
+
+# 各索引类型的默认参数；nlist 为 0 表示根据向量数量自动确定
+DEFAULT_INDEX_PARAMS = {
+    "flat": {},
+    "sq_fp16": {},
+    "sq8": {},
+    # 二值索引按汉明距离召回 rescore_k 个候选，再用 vectors.npy 中的原始向量精排
+    "binary_rescore": {"rescore_k": 100},
+    "ivf_flat": {"nlist": 0, "nprobe": 16},
+    "ivf_pq": {"nlist": 0, "nprobe": 16, "pq_m": 64, "pq_nbits": 8},
+    "hnsw": {"hnsw_m": 32, "ef_construction": 200, "ef_search": 64},
+}
+
+# 训练 IVF 时每个聚类中心至少需要的样本数（低于此值 FAISS 会给出警告，聚类质量也会下降）
+MIN_POINTS_PER_CENTROID = 39
+# 训练时每个聚类中心最多使用的样本数
+MAX_POINTS_PER_CENTROID = 256
+# 非 IVF 索引（如 SQ8）训练时最多使用的样本数
+MAX_TRAIN_SAMPLES = 65536
+
+
+def index_params(index_type: str = "flat", reduce_method: str = "none", reduce_dim: int | None = None,
+                 **overrides) -> dict:
+    """
+    生成某种索引类型的完整参数，未指定的项使用默认值。
+    reduce_method 为 truncate（Matryoshka 截断并重新归一化）或 pca 时，索引建立在 reduce_dim 维的向量上。
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+    if reduce_method not in REDUCE_METHODS:
+        raise ValueError(f"不支持的降维方式: {reduce_method}，可选: {', '.join(REDUCE_METHODS)}")
+    if reduce_method != "none" and not reduce_dim:
+        raise ValueError("降维时必须指定目标维度 reduce_dim")
+    params = {"index_type": index_type, **DEFAULT_INDEX_PARAMS[index_type]}
+    if reduce_method != "none":
+        params["reduce_method"] = reduce_method
+        params["reduce_dim"] = reduce_dim
+    params.update({key: value for key, value in overrides.items()
+                   if key in params and value is not None})
+    return params
+
+
+def resolve_nlist(params: dict, ntotal: int) -> int:
+    """确定 IVF 的聚类中心数：默认取 4 * sqrt(n)，并保证每个中心有足够的训练样本。"""
+    nlist = params.get("nlist") or int(4 * math.sqrt(ntotal))
+    return max(1, min(nlist, ntotal // MIN_POINTS_PER_CENTROID))
+
+
+def create_index(params: dict, dimension: int, ntotal: int) -> faiss.Index:
+    """
+    根据参数创建一个空索引（L2 距离）。ntotal 为预计加入的向量数，用于确定 IVF 的 nlist。
+    """
+    index_type = params["index_type"]
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "sq_fp16":
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    if index_type == "binary_rescore":
+        if dimension % 8:
+            raise ValueError(f"二值索引要求向量维度为 8 的倍数，当前为 {dimension}")
+        return faiss.IndexBinaryFlat(dimension)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return index
+
+    params["nlist"] = resolve_nlist(params, ntotal)
+    if index_type == "ivf_flat":
+        return faiss.index_factory(dimension, f"IVF{params['nlist']},Flat")
+    if index_type == "ivf_pq":
+        if dimension % params["pq_m"]:
+            raise ValueError(f"pq_m ({params['pq_m']}) 必须能整除向量维度 ({dimension})")
+        # PQ 码本同样需要足够的训练样本，向量较少时降低编码位数
+        max_nbits = max(1, int(math.log2(max(ntotal // MIN_POINTS_PER_CENTROID, 2))))
+        params["pq_nbits"] = min(params["pq_nbits"], max_nbits)
+        return faiss.index_factory(dimension, f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}")
+    raise ValueError(f"不支持的索引类型: {index_type}")
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, transform: "VectorTransform | None" = None,
+                seed: int = 0) -> None:
+    """
+    训练需要训练的索引（IVF 系列、SQ8）。vectors 可以是 memmap，只会读取抽样到的行。
+    抽样使用固定种子，保证同样的输入得到同样的索引。
+    """
+    if index.is_trained:
+        return
+    try:
+        max_samples = faiss.extract_index_ivf(index).nlist * MAX_POINTS_PER_CENTROID
+    except RuntimeError:
+        max_samples = MAX_TRAIN_SAMPLES
+    if len(vectors) > max_samples:
+        rows = np.sort(np.random.default_rng(seed).choice(len(vectors), max_samples, replace=False))
+        sample = np.ascontiguousarray(vectors[rows])
+    else:
+        sample = np.ascontiguousarray(vectors[:])
+    if transform is not None:
+        sample = transform.apply(sample)
+    index.train(sample)
+
+
+class VectorTransform:
+    """
+    构建索引前对向量做的降维变换，查询向量必须经过同一个变换：
+    - none: 不变换
+    - truncate: 保留前 reduce_dim 维并重新做 L2 归一化（适用于 Qwen3-Embedding 等 Matryoshka 模型）
+    - pca: 构建时在向量样本上训练的 PCA 投影
+    """
+
+    def __init__(self, method: str = "none", input_dim: int | None = None, output_dim: int | None = None,
+                 pca: faiss.PCAMatrix | None = None):
+        self.method = method
+        self.input_dim = input_dim
+        self.output_dim = output_dim if method != "none" else input_dim
+        if method == "pca" and pca is None:
+            pca = faiss.PCAMatrix(input_dim, output_dim)
+        self.pca = pca
+
+    @classmethod
+    def from_params(cls, params: dict, input_dim: int) -> "VectorTransform":
+        return cls(params.get("reduce_method", "none"), input_dim, params.get("reduce_dim"))
+
+    @property
+    def is_trained(self) -> bool:
+        return self.pca is None or self.pca.is_trained
+
+    def train(self, vectors: np.ndarray, max_samples: int = MAX_TRAIN_SAMPLES, seed: int = 0) -> None:
+        if self.is_trained:
+            return
+        if len(vectors) > max_samples:
+            rows = np.sort(np.random.default_rng(seed).choice(len(vectors), max_samples, replace=False))
+            sample = vectors[rows]
+        else:
+            sample = vectors[:]
+        self.pca.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+    def apply(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.method == "truncate":
+            vectors = np.ascontiguousarray(vectors[:, :self.output_dim])
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            return vectors / np.maximum(norms, 1e-12)
+        if self.method == "pca":
+            return self.pca.apply_py(vectors)
+        return vectors
+
+    def save(self, index_path: str) -> None:
+        if self.pca is not None:
+            faiss.write_VectorTransform(self.pca, os.path.join(index_path, PCA_FILE))
+
+    @classmethod
+    def deserialize(cls, params: dict, data) -> "VectorTransform":
+        pca = None
+        if params.get("reduce_method") == "pca":
+            reader = faiss.VectorIOReader()
+            faiss.copy_array_to_vector(np.frombuffer(data, dtype=np.uint8), reader.data)
+            pca = faiss.read_VectorTransform(reader)
+        return cls(params.get("reduce_method", "none"), params.get("dimension"), params.get("reduce_dim"), pca)
+
+    @classmethod
+    def load(cls, index_path: str, params: dict) -> "VectorTransform":
+        method = params.get("reduce_method", "none")
+        pca = None
+        if method == "pca":
+            pca = faiss.read_VectorTransform(os.path.join(index_path, PCA_FILE))
+        return cls(method, params.get("dimension"), params.get("reduce_dim"), pca)
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """按符号位把浮点向量压缩为二值编码，每 8 维占 1 字节。"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def add_vectors(index, vectors: np.ndarray, transform: VectorTransform | None = None) -> None:
+    """向索引加入一批向量（先经过降维变换），二值索引会再转换为二值编码。"""
+    if transform is not None:
+        vectors = transform.apply(vectors)
+    if isinstance(index, faiss.IndexBinary):
+        index.add(binarize(vectors))
+    else:
+        index.add(np.ascontiguousarray(vectors))
+
+
+def write_index(index, index_file: str) -> None:
+    if isinstance(index, faiss.IndexBinary):
+        faiss.write_index_binary(index, index_file)
+    else:
+        faiss.write_index(index, index_file)
+
+
+def index_nbytes(index) -> int:
+    """索引序列化后的字节数，近似等于加载后常驻内存的大小。"""
+    if isinstance(index, BinaryRescoreIndex):
+        index = index.binary_index
+    if isinstance(index, faiss.IndexBinary):
+        return faiss.serialize_index_binary(index).nbytes
+    return faiss.serialize_index(index).nbytes
+
+
+class BinaryRescoreIndex:
+    """
+    两阶段检索：先在二值索引上按汉明距离取 rescore_k 个候选，
+    再用原始 float32 向量计算 L2 距离精排。原始向量以 memmap 方式读取，
+    常驻内存的只有每条 dimension / 8 字节的二值编码。
+    启用降维时，候选向量在精排前经过与查询相同的 transform。
+    对外提供与 faiss.Index 相同的 ntotal / d / search 接口。
+    """
+
+    def __init__(self, binary_index, vectors: np.ndarray, rescore_k: int, transform: VectorTransform | None = None):
+        self.binary_index = binary_index
+        self.vectors = vectors
+        self.rescore_k = rescore_k
+        self.transform = transform
+
+    @property
+    def ntotal(self) -> int:
+        return self.binary_index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.binary_index.d
+
+    def search(self, x: np.ndarray, k: int):
+        x = np.asarray(x, dtype=np.float32)
+        _, candidates = self.binary_index.search(binarize(x), max(k, self.rescore_k))
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        ids = np.full((len(x), k), -1, dtype=np.int64)
+        for row, (query, ids_row) in enumerate(zip(x, candidates)):
+            # memmap 上的花式索引要求有序下标，按顺序读取也更利于磁盘预读
+            ids_row = np.unique(ids_row[ids_row >= 0])
+            if not len(ids_row):
+                continue
+            candidates_vectors = np.asarray(self.vectors[ids_row], dtype=np.float32)
+            if self.transform is not None:
+                candidates_vectors = self.transform.apply(candidates_vectors)
+            diff = candidates_vectors - query
+            row_distances = np.einsum('ij,ij->i', diff, diff)
+            order = np.argsort(row_distances)[:k]
+            distances[row, :len(order)] = row_distances[order]
+            ids[row, :len(order)] = ids_row[order]
+        return distances, ids
+
+
+def set_search_threads(num_threads: int | None) -> int:
+    """
+    设置 FAISS 的 OpenMP 线程数（整个进程生效），None 时保持 FAISS 的默认值（通常为 CPU 核数），返回生效的线程数。
+    多个线程同时调用 search 时，每次调用都会使用全部 OpenMP 线程，线程总数会超过核数。
+    """
+    if num_threads is not None:
+        faiss.omp_set_num_threads(max(1, num_threads))
+    return faiss.omp_get_max_threads()
+
+
+def apply_search_params(index: faiss.Index, params: dict) -> None:
+    """把保存的搜索参数（nprobe / efSearch）应用到加载的索引上。"""
+    space = faiss.ParameterSpace()
+    if "nprobe" in params:
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+    if "ef_search" in params:
+        space.set_index_parameter(index, "efSearch", params["ef_search"])
+
+
+def save_index_params(index_path: str, params: dict) -> None:
+    with open(os.path.join(index_path, PARAMS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(params, f, ensure_ascii=False, indent=4)
+
+
+def load_index_params(index_path: str) -> dict:
+    """读取索引参数；旧版索引目录没有参数文件，视为 flat 索引。"""
+    params_file = os.path.join(index_path, PARAMS_FILE)
+    if not os.path.exists(params_file):
+        return index_params("flat")
+    with open(params_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def prepare_index(index, params: dict, transform: VectorTransform, vectors: np.ndarray | None = None):
+    """
+    为已读入的索引应用搜索参数；二值索引包装为 BinaryRescoreIndex（需要原始向量 vectors）。
+    """
+    if isinstance(index, faiss.IndexBinary):
+        if vectors is None:
+            raise ValueError("binary_rescore 索引需要原始向量才能精排")
+        return BinaryRescoreIndex(index, vectors, params["rescore_k"], transform)
+    apply_search_params(index, params)
+    return index
+
+
+def load_index(index_path: str):
+    """
+    加载索引目录中的 index.faiss，并应用保存的搜索参数。
+    返回 (index, params, transform)；二值索引会包装为 BinaryRescoreIndex，
+    transform 是查询向量在搜索前需要经过的降维变换。
+    """
+    params = load_index_params(index_path)
+    transform = VectorTransform.load(index_path, params)
+    index_file = os.path.join(index_path, "index.faiss")
+    if params["index_type"] == "binary_rescore":
+        vectors = np.load(os.path.join(index_path, "vectors.npy"), mmap_mode='r')
+        index = prepare_index(faiss.read_index_binary(index_file), params, transform, vectors)
+    else:
+        index = prepare_index(faiss.read_index(index_file), params, transform)
+    return index, params, transform